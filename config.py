@@ -1,9 +1,35 @@
 # TuneHub Subsonic Proxy Configuration
 
 import os
-from dotenv import load_dotenv
+import sys
+from enum import IntEnum
+from types import MappingProxyType
 
-load_dotenv()
+# Parse .env only once per process, even if this module is re-imported
+# (werkzeug reloader, test runners, importlib.reload)
+_DOTENV_LOADED_KEY = "__tunehub_dotenv_loaded__"
+if not getattr(sys, _DOTENV_LOADED_KEY, False):
+    try:
+        # Pre-generated by tools/freeze_env.py - skips parsing .env at runtime
+        from env_generated import ENV as _FROZEN_ENV
+    except ImportError:
+        from dotenv import load_dotenv
+        load_dotenv()
+    else:
+        # Same precedence as load_dotenv(): real environment variables win
+        for _key, _value in _FROZEN_ENV.items():
+            os.environ.setdefault(_key, _value)
+    setattr(sys, _DOTENV_LOADED_KEY, True)
+
+# Every environment variable is resolved exactly once, here. Other modules must
+# import these constants instead of calling os.getenv() themselves.
+__all__ = [
+    "TUNEHUB_API_KEY", "TUNEHUB_BASE_URL",
+    "SUBSONIC_USER", "SUBSONIC_PASSWORD", "SUBSONIC_SERVER_NAME", "SUBSONIC_VERSION",
+    "DEFAULT_PLATFORM", "DEFAULT_QUALITY", "QUALITIES", "SEARCH_PLATFORMS", "SearchMode", "SEARCH_MODE",
+    "SERVER_HOST", "SERVER_PORT", "LOG_FILE_LEVEL", "DATA_DIR", "PLAYLIST_REFRESH_INTERVAL",
+    "AUDIO_CACHE_MAX_SIZE", "AUDIO_ACCEL_REDIRECT", "AUDIO_X_SENDFILE", "COVER_CACHE_MAX_SIZE", "PLATFORMS", "ALLOWED_PLAYLISTS",
+]
 
 # TuneHub API Configuration
 TUNEHUB_API_KEY = os.getenv("TUNEHUB_API_KEY", "")
@@ -16,37 +42,92 @@ SUBSONIC_SERVER_NAME = "TuneHub Subsonic Proxy"
 SUBSONIC_VERSION = "1.16.1"
 
 # Default Settings
-DEFAULT_PLATFORM = os.getenv("DEFAULT_PLATFORM", "netease")  # netease | qq | kuwo
-DEFAULT_QUALITY = os.getenv("DEFAULT_QUALITY", "320k")  # 128k | 320k | flac | flac24bit
+# Values read from the environment are interned so that comparisons against the
+# (compiler-interned) platform/quality literals used elsewhere hit the identity fast path
+DEFAULT_PLATFORM = sys.intern(os.getenv("DEFAULT_PLATFORM", "netease"))  # netease | qq | kuwo
+DEFAULT_QUALITY = sys.intern(os.getenv("DEFAULT_QUALITY", "320k"))  # 128k | 320k | flac | flac24bit
+QUALITIES = ("128k", "320k", "flac", "flac24bit")
 
 # Search Settings
 # Options: "qq" (QQ only), "netease" (Netease only), "both" (both platforms, QQ first)
-SEARCH_PLATFORMS = os.getenv("SEARCH_PLATFORMS", "both")
+SEARCH_PLATFORMS = sys.intern(os.getenv("SEARCH_PLATFORMS", "both").lower())
+
+
+class SearchMode(IntEnum):
+    """Search platform mode, resolved once from SEARCH_PLATFORMS"""
+    QQ = 0
+    NETEASE = 1
+    BOTH = 2
+
+
+_SEARCH_MODES = {
+    "qq": SearchMode.QQ,
+    "netease": SearchMode.NETEASE,
+    "both": SearchMode.BOTH,
+}
 
 # Server Settings
 SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
 SERVER_PORT = int(os.getenv("SERVER_PORT", "4040"))
 
+# Minimum level written to server.log: DEBUG | INFO | WARNING | ERROR
+LOG_FILE_LEVEL = os.getenv("LOG_FILE_LEVEL", "INFO").upper()
+_LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+# Data directory (for Docker: /app/cache, local: next to the sources)
+DATA_DIR = os.getenv("CACHE_DIR", os.path.dirname(__file__))
+
+# Playlist auto-refresh interval in seconds (env value is in hours)
+PLAYLIST_REFRESH_INTERVAL = int(os.getenv("PLAYLIST_REFRESH_HOURS", "3")) * 60 * 60  # Default: 3 hours
+
 # Audio Cache Settings
 AUDIO_CACHE_MAX_SIZE = int(os.getenv("AUDIO_CACHE_MAX_SIZE", str(10 * 1024 * 1024 * 1024)))  # Default: 10GB
 
-# Supported Platforms Mapping
-PLATFORMS = {
+# Internal nginx location mapped to the audio cache directory (e.g. "/internal_audio/").
+# When set, cached audio is handed to nginx via X-Accel-Redirect instead of being sent by Flask.
+AUDIO_ACCEL_REDIRECT = os.getenv("AUDIO_ACCEL_REDIRECT", "")
+
+# Behind Apache (mod_xsendfile) or lighttpd: hand cached files over with an X-Sendfile header
+AUDIO_X_SENDFILE = os.getenv("AUDIO_X_SENDFILE", "").lower() in ("1", "true", "yes")
+
+# Cover Art Cache Settings
+COVER_CACHE_MAX_SIZE = int(os.getenv("COVER_CACHE_MAX_SIZE", str(200 * 1024 * 1024)))  # Default: 200MB
+
+# Supported Platforms Mapping (read-only)
+PLATFORMS = MappingProxyType({
     "netease": {"name": "网易云音乐", "tag": "primary"},
     "qq": {"name": "QQ音乐", "tag": "success"},
     "kuwo": {"name": "酷我音乐", "tag": "warning"},
-}
+})
 
 # Allowed Playlists Whitelist (empty = show all)
-# Format: {"platform": [list of playlist IDs]}
+# Format: {"platform": frozenset of playlist IDs} - frozensets give O(1) membership tests
 # Note: QQ playlists removed because TuneHub API returns error for QQ toplist details
 ALLOWED_PLAYLISTS = {
-    "netease": [
+    "netease": frozenset({
         "19723756",   # 飙升榜
         "3778678",    # 热歌榜
         "991319590",  # 中文说唱榜
         "60198",      # 美国Billboard榜
-    ],
-    "qq": [],  # QQ toplist API not working (returns error 10006)
-    "kuwo": [],  # Excluded per user request
+    }),
+    "qq": frozenset(),  # QQ toplist API not working (returns error 10006)
+    "kuwo": frozenset(),  # Excluded per user request
 }
+
+
+# ============ Validation ============
+# Fail fast on bad settings so request handlers can trust these values as-is
+
+if DEFAULT_PLATFORM not in PLATFORMS:
+    raise ValueError(f"Invalid DEFAULT_PLATFORM {DEFAULT_PLATFORM!r}, expected one of: {', '.join(PLATFORMS)}")
+
+if DEFAULT_QUALITY not in QUALITIES:
+    raise ValueError(f"Invalid DEFAULT_QUALITY {DEFAULT_QUALITY!r}, expected one of: {', '.join(QUALITIES)}")
+
+if SEARCH_PLATFORMS not in _SEARCH_MODES:
+    raise ValueError(f"Invalid SEARCH_PLATFORMS {SEARCH_PLATFORMS!r}, expected one of: {', '.join(_SEARCH_MODES)}")
+
+SEARCH_MODE = _SEARCH_MODES[SEARCH_PLATFORMS]
+
+if LOG_FILE_LEVEL not in _LOG_LEVELS:
+    raise ValueError(f"Invalid LOG_FILE_LEVEL {LOG_FILE_LEVEL!r}, expected one of: {', '.join(_LOG_LEVELS)}")
@@ -2,47 +2,173 @@
 # A virtual Subsonic server that bridges TuneHub music API to Subsonic clients
 
 from flask import Flask, request, Response, redirect, send_file
-from functools import wraps
+from functools import wraps, lru_cache
+from collections import OrderedDict
 import hashlib
+import hmac
 import logging
 import time
 import json
 import os
+import sys
+import random
+import secrets
+import uuid
+import itertools
+import shutil
+import mmap
+import sqlite3
 import atexit
-from logging.handlers import RotatingFileHandler
+import gzip
+import zlib
+import re
+import bisect
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from html import escape as html_escape
+from string import Template
+from typing import Optional
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+import queue
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 
 from config import (
     SUBSONIC_USER, SUBSONIC_PASSWORD, SUBSONIC_VERSION,
     SERVER_HOST, SERVER_PORT, DEFAULT_PLATFORM, DEFAULT_QUALITY,
-    ALLOWED_PLAYLISTS, AUDIO_CACHE_MAX_SIZE, SEARCH_PLATFORMS
+    ALLOWED_PLAYLISTS, AUDIO_CACHE_MAX_SIZE, SEARCH_PLATFORMS,
+    DATA_DIR, PLAYLIST_REFRESH_INTERVAL, SearchMode, SEARCH_MODE,
+    AUDIO_ACCEL_REDIRECT, AUDIO_X_SENDFILE, COVER_CACHE_MAX_SIZE, LOG_FILE_LEVEL, PLATFORMS
 )
 from tunehub_client import tunehub_client, TuneHubClient
 from subsonic_formatter import (
     format_ping, format_license, format_playlists, format_playlist,
     format_search_result, format_error, format_response,
     format_music_folders, format_indexes, format_song,
-    create_subsonic_response, SubElement, _set_song_attributes
+    create_subsonic_response, SubElement, _set_song_attributes,
+    format_lyrics_xml, iter_structured_lyrics_xml, XML_CONTENT_TYPE, PLATFORM_DISPLAY_NAMES
 )
 
 # Configure logging - both console and file
-logging.basicConfig(level=logging.INFO)
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+logging.basicConfig(level=logging.INFO, handlers=[console_handler])
 logger = logging.getLogger(__name__)
+# Console stays at INFO; the logger opens up to DEBUG when LOG_FILE_LEVEL asks for it
+logger.setLevel(min(logging.getLevelName(LOG_FILE_LEVEL), logging.INFO))
 
-# Add file handler for persistent logs
+# Add file handler for persistent logs. Records go through a queue to a
+# background listener so request threads never wait on disk I/O.
 file_handler = RotatingFileHandler('server.log', maxBytes=5*1024*1024, backupCount=3)
 file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger.addHandler(file_handler)
+file_handler.setLevel(LOG_FILE_LEVEL)
+log_queue = queue.SimpleQueue()
+logger.addHandler(QueueHandler(log_queue))
+log_listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
 
 app = Flask(__name__)
+# send_file() then emits X-Sendfile and an empty body; the front server streams the file
+app.config["USE_X_SENDFILE"] = AUDIO_X_SENDFILE
+
+# ============ Response Compression ============
+# Subsonic XML/JSON, M3U and HTML bodies are highly repetitive, so gzip them for
+# clients that accept it. Audio and cover art are already compressed and skipped.
+COMPRESSIBLE_MIMETYPES = frozenset({
+    "text/xml", "application/xml", "application/json", "text/html", "audio/x-mpegurl",
+})
+COMPRESS_MIN_SIZE = 500  # bytes; smaller bodies aren't worth the gzip header
+COMPRESS_LEVEL = 6
+
+def _gzip_stream(chunks):
+    """Gzip a streamed response body chunk by chunk"""
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+@app.after_request
+def compress_response(response):
+    """Gzip compressible responses when the client sends Accept-Encoding: gzip"""
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or not request.accept_encodings["gzip"]):
+        return response
+    
+    if response.is_streamed:
+        response.response = _gzip_stream(response.response)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(gzip.compress(data, COMPRESS_LEVEL))
+    
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    # The body bytes changed, so a strong ETag would no longer be accurate
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+# ============ Outbound HTTP ============
+# One pooled keep-alive session for covers, lyrics and tee'd audio streams, so
+# repeat requests to the same CDN host skip the TCP/TLS handshake.
+BROWSER_USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
+
+http_session = requests.Session()
+http_session.headers["User-Agent"] = BROWSER_USER_AGENT
+# Retry connect/read hiccups twice with a short backoff (0.2s, 0.4s) instead of failing the request
+_http_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=Retry(total=2, backoff_factor=0.2))
+http_session.mount("https://", _http_adapter)
+http_session.mount("http://", _http_adapter)
+
+# Background downloads hold a connection for the whole transfer, so each download_pool
+# worker (long-lived threads) gets its own session rather than drawing on the shared pool
+_download_local = threading.local()
+
+def download_session() -> requests.Session:
+    """Return the calling download worker's own keep-alive session"""
+    session = getattr(_download_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers["User-Agent"] = BROWSER_USER_AGENT
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=Retry(total=2, backoff_factor=0.2))
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _download_local.session = session
+    return session
+
+# Long-lived pool for short upstream fan-out (multi-platform search/toplists, lyric
+# prefetch), so requests don't pay thread start-up and concurrent calls stay bounded
+upstream_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="tunehub")
 
 # ============ Caching Infrastructure ============
-import threading
 
 # Cache duration: 6 hours
 CACHE_DURATION = 6 * 60 * 60
 
-# Thread lock for cache operations
-cache_lock = threading.Lock()
+# Plain gets/sets/pops on the cache dicts are lock-free. Only get_cached's
+# compare-and-evict of an expired entry needs a lock, and it is striped by key so
+# a playlist eviction never waits on a lyrics or stream URL eviction.
+EVICT_LOCK_STRIPES = 16
+_evict_locks = tuple(threading.Lock() for _ in range(EVICT_LOCK_STRIPES))
 
 # Playlist cache (toplists)
 playlist_cache = {}
@@ -53,28 +179,21 @@ stream_url_cache = {}
 # Song metadata cache (from parse results)
 song_metadata_cache = {}
 
-# Data directory (for Docker: /app/cache, local: ./)
-DATA_DIR = os.environ.get("CACHE_DIR", os.path.dirname(__file__))
-
 # Local audio file cache directory
 AUDIO_CACHE_DIR = os.path.join(DATA_DIR, "audio")
 os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
 
+# Unsafe filename characters -> underscore, applied in one str.translate() pass
+_UNSAFE_FILENAME_CHARS = str.maketrans(dict.fromkeys('/\\:*?"<>|\n\r\t', '_'))
+
 def sanitize_filename(name: str) -> str:
     """Sanitize a string for use in a filename, removing or replacing unsafe characters"""
     if not name:
         return ""
-    # Replace unsafe characters with underscores
-    unsafe_chars = ['/', '\\', ':', '*', '?', '"', '<', '>', '|', '\n', '\r', '\t']
-    result = name
-    for char in unsafe_chars:
-        result = result.replace(char, '_')
-    # Remove leading/trailing spaces and dots
-    result = result.strip(' .')
+    # Replace unsafe characters, then remove leading/trailing spaces and dots
+    result = name.translate(_UNSAFE_FILENAME_CHARS).strip(' .')
     # Limit length to avoid too long filenames
-    if len(result) > 50:
-        result = result[:50]
-    return result
+    return result[:50]
 
 def get_audio_cache_path(song_id: str, quality: str, metadata: dict = None) -> str:
     """Get the local file path for a cached audio file
@@ -82,24 +201,30 @@ def get_audio_cache_path(song_id: str, quality: str, metadata: dict = None) -> s
     If metadata is provided, uses format: 歌曲_歌手_专辑_platform_id_quality.ext
     Otherwise falls back to: platform_id_quality.ext
     """
+    if metadata:
+        return _build_audio_cache_path(song_id, quality, metadata.get("title", ""),
+                                       metadata.get("artist", ""), metadata.get("album", ""))
+    return _build_audio_cache_path(song_id, quality, "", "", "")
+
+@lru_cache(maxsize=4096)
+def _build_audio_cache_path(song_id: str, quality: str, title: str, artist: str, album: str) -> str:
+    """get_audio_cache_path() body, memoized on the fields it reads (sanitizing is the costly part)"""
     # Use appropriate extension based on quality
     ext = "flac" if quality in ("flac", "flac24bit") else "mp3"
     
     # Parse platform and actual_id from song_id (format: platform:actual_id)
-    if ":" in song_id:
-        platform, actual_id = song_id.split(":", 1)
-    else:
-        platform = "unknown"
-        actual_id = song_id
+    platform, sep, actual_id = song_id.partition(":")
+    if not sep:
+        platform, actual_id = "unknown", song_id
     
     # Sanitize actual_id for filesystem
     safe_id = actual_id.replace("/", "_")
     
-    if metadata:
+    if title or artist or album:
         # Use friendly format: 歌曲_歌手_专辑_platform_id_quality.ext
-        title = sanitize_filename(metadata.get("title", ""))
-        artist = sanitize_filename(strip_platform_prefix(metadata.get("artist", "")))
-        album = sanitize_filename(metadata.get("album", ""))
+        title = sanitize_filename(title)
+        artist = sanitize_filename(strip_platform_prefix(artist))
+        album = sanitize_filename(album)
         
         if title and artist:
             # Build filename parts
@@ -116,74 +241,405 @@ def get_audio_cache_path(song_id: str, quality: str, metadata: dict = None) -> s
 def is_audio_cached(song_id: str, quality: str, metadata: dict = None) -> bool:
     """Check if audio file exists in local cache"""
     path = get_audio_cache_path(song_id, quality, metadata)
-    return os.path.exists(path) and os.path.getsize(path) > 0
+    # Files this process indexed need no syscall at all
+    if path in audio_index:
+        return True
+    # One stat() call instead of exists() + getsize()
+    try:
+        return os.stat(path).st_size > 0
+    except OSError:
+        return False
+
+def send_cached_audio(audio_path: str) -> Response:
+    """Serve a cached audio file with Range/conditional support, or offload it to nginx"""
+    mimetype = "audio/flac" if audio_path.endswith(".flac") else "audio/mpeg"
+    touch_audio_index(audio_path)
+    if AUDIO_ACCEL_REDIRECT:
+        # nginx serves the file itself (sendfile, ranges) from an internal location
+        accel_path = AUDIO_ACCEL_REDIRECT.rstrip("/") + "/" + quote(os.path.basename(audio_path))
+        return Response(headers={"X-Accel-Redirect": accel_path, "Content-Type": mimetype})
+    # conditional=True answers Range / If-None-Match from the file without reading all of it;
+    # under gunicorn/uwsgi the body goes out through wsgi.file_wrapper (sendfile)
+    return send_file(audio_path, mimetype=mimetype, conditional=True, etag=True, max_age=CACHE_DURATION)
+
+# In-memory LRU index of the audio cache: path -> (mtime, size), least recently
+# used first, plus a running total. Built once at startup and updated on
+# download/play/delete, so size checks and cleanup never walk the directory again.
+audio_index = OrderedDict()
+audio_total_size = 0
+audio_lock = threading.Lock()
+
+def build_audio_index():
+    """Scan the audio cache directory once and populate audio_index
+    
+    Leftover .tmp files from downloads interrupted by a restart are deleted,
+    since nothing will ever finish them.
+    """
+    global audio_total_size
+    orphans = 0
+    with audio_lock:
+        audio_index.clear()
+        files = []
+        with os.scandir(AUDIO_CACHE_DIR) as it:
+            for entry in it:
+                # d_type from the directory read; stat() is only needed for real files
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                if entry.name.endswith('.tmp'):
+                    try:
+                        os.remove(entry.path)
+                        orphans += 1
+                    except OSError:
+                        pass
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                files.append((st.st_mtime, st.st_size, entry.path))
+        # Oldest first, so the LRU order starts out as mtime order
+        files.sort()
+        for mtime, size, path in files:
+            audio_index[path] = (mtime, size)
+        audio_total_size = sum(size for _, size, _ in files)
+    if orphans:
+        logger.info(f"[CACHE] Removed {orphans} incomplete downloads")
+    logger.info(f"[CACHE] Indexed {len(audio_index)} audio files ({audio_total_size / 1024 / 1024 / 1024:.2f} GB)")
+
+def add_to_audio_index(path: str, size: int):
+    """Record a newly completed audio file in the index"""
+    global audio_total_size
+    with audio_lock:
+        previous = audio_index.get(path)
+        if previous:
+            audio_total_size -= previous[1]
+        audio_index[path] = (time.time(), size)
+        audio_index.move_to_end(path)
+        audio_total_size += size
+
+def touch_audio_index(path: str):
+    """Mark a cached audio file as most recently used"""
+    with audio_lock:
+        if path in audio_index:
+            audio_index.move_to_end(path)
 
 def get_audio_cache_size() -> int:
-    """Get total size of audio cache in bytes"""
-    total = 0
-    for f in os.listdir(AUDIO_CACHE_DIR):
-        path = os.path.join(AUDIO_CACHE_DIR, f)
-        if os.path.isfile(path):
-            total += os.path.getsize(path)
-    return total
+    """Get total size of audio cache in bytes (from the in-memory index)"""
+    return audio_total_size
 
 def cleanup_audio_cache():
     """Delete oldest files if cache exceeds max size"""
+    global audio_total_size
+    try:
+        with audio_lock:
+            if audio_total_size <= AUDIO_CACHE_MAX_SIZE:
+                return
+            
+            logger.info(f"[CACHE] Size {audio_total_size / 1024 / 1024 / 1024:.2f} GB exceeds limit {AUDIO_CACHE_MAX_SIZE / 1024 / 1024 / 1024:.2f} GB, cleaning up...")
+            
+            # Evict least recently used files until under limit
+            deleted_count = 0
+            while audio_index and audio_total_size > AUDIO_CACHE_MAX_SIZE:
+                path, (mtime, size) = audio_index.popitem(last=False)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass  # Already gone, just drop it from the index
+                audio_total_size -= size
+                deleted_count += 1
+            
+            logger.info(f"[CACHE] Deleted {deleted_count} old files, new size: {audio_total_size / 1024 / 1024 / 1024:.2f} GB")
+    except Exception as e:
+        logger.error(f"[CACHE] Cleanup error: {e}")
+
+_audio_cleanup_needed = threading.Event()
+
+def audio_cleanup_worker():
+    """Background task that evicts audio files whenever a download pushes the cache over its limit"""
+    while True:
+        _audio_cleanup_needed.wait()
+        _audio_cleanup_needed.clear()
+        cleanup_audio_cache()
+
+def start_audio_cleanup_worker():
+    """Start the background audio cache maintainer thread"""
+    threading.Thread(target=audio_cleanup_worker, daemon=True, name="AudioCacheCleanup").start()
+
+
+# Background downloads run on a small shared pool instead of a new thread per
+# stream; downloads_in_flight keeps two requests from fetching the same file.
+DOWNLOAD_WORKERS = 4
+download_pool = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix="audio-dl")
+downloads_in_flight = set()
+
+def finish_audio_file(temp_path: str, audio_path: str, song_id: str):
+    """Move a fully downloaded temp file into place and account for it in the index"""
+    os.rename(temp_path, audio_path)
+    file_size = os.path.getsize(audio_path)
+    add_to_audio_index(audio_path, file_size)
+    logger.info(f"[DOWNLOAD] Completed: {song_id} ({file_size / 1024 / 1024:.1f} MB)")
+    
+    # Clean up cache if exceeds max size - on the maintainer thread, since this may
+    # run on a request thread when a tee'd stream closes
+    if audio_total_size > AUDIO_CACHE_MAX_SIZE:
+        _audio_cleanup_needed.set()
+
+def download_audio_background(url, song_id, quality, song_metadata):
+    """Download an audio file into the local cache (runs on download_pool)"""
+    try:
+        audio_path = get_audio_cache_path(song_id, quality, song_metadata)
+        logger.info(f"[DOWNLOAD] Starting background download: {song_id} -> {os.path.basename(audio_path)}")
+        
+        # Download the audio file
+        with download_session().get(url, timeout=120, stream=True) as audio_response:
+            if audio_response.ok:
+                # Save to temporary file first, then rename. copyfileobj moves 64 KiB
+                # blocks straight from the socket instead of looping over small chunks.
+                temp_path = f"{audio_path}.{uuid.uuid4().hex}.tmp"
+                audio_response.raw.decode_content = True
+                try:
+                    with open(temp_path, 'wb') as f:
+                        shutil.copyfileobj(audio_response.raw, f, length=65536)
+                except Exception:
+                    try:
+                        os.remove(temp_path)
+                    except FileNotFoundError:
+                        pass
+                    raise
+                
+                finish_audio_file(temp_path, audio_path, song_id)
+            else:
+                logger.warning(f"[DOWNLOAD] Failed to download {song_id}: HTTP {audio_response.status_code}")
+    except Exception as e:
+        logger.error(f"[DOWNLOAD] Error downloading {song_id}: {e}")
+    finally:
+        with audio_lock:
+            downloads_in_flight.discard((song_id, quality))
+
+def submit_audio_download(url, song_id, quality, song_metadata) -> bool:
+    """Queue a background download unless the same song/quality is already queued"""
+    key = (song_id, quality)
+    with audio_lock:
+        if key in downloads_in_flight:
+            logger.info(f"[DOWNLOAD] Already queued: {song_id}")
+            return False
+        downloads_in_flight.add(key)
+    try:
+        download_pool.submit(download_audio_background, url, song_id, quality, song_metadata)
+    except RuntimeError as e:
+        # Pool already shut down (interpreter exiting) - release the claim
+        with audio_lock:
+            downloads_in_flight.discard(key)
+        logger.warning(f"[DOWNLOAD] Could not queue {song_id}: {e}")
+        return False
+    return True
+
+def stream_and_cache_audio(url, song_id, quality, song_metadata):
+    """Proxy upstream audio to the client while writing it to the local cache
+    
+    One upstream fetch serves both the first play and the cache. Returns None if
+    the file is already being downloaded or upstream can't be opened, in which
+    case the caller should fall back to a redirect.
+    """
+    key = (song_id, quality)
+    with audio_lock:
+        if key in downloads_in_flight:
+            return None
+        downloads_in_flight.add(key)
+    
+    try:
+        upstream = http_session.get(url, timeout=120, stream=True)
+        if not upstream.ok:
+            logger.warning(f"[TEE] Upstream returned HTTP {upstream.status_code} for {song_id}")
+            upstream.close()
+            upstream = None
+    except Exception as e:
+        logger.warning(f"[TEE] Failed to open upstream for {song_id}: {e}")
+        upstream = None
+    if upstream is None:
+        with audio_lock:
+            downloads_in_flight.discard(key)
+        return None
+    
+    audio_path = get_audio_cache_path(song_id, quality, song_metadata)
+    temp_path = f"{audio_path}.{uuid.uuid4().hex}.tmp"
+    state = {"complete": False}
+    logger.info(f"[TEE] Streaming and caching: {song_id} -> {os.path.basename(audio_path)}")
+    
+    def generate():
+        with open(temp_path, 'wb') as f:
+            for chunk in upstream.iter_content(chunk_size=65536):
+                f.write(chunk)
+                yield chunk
+        finish_audio_file(temp_path, audio_path, song_id)
+        state["complete"] = True
+    
+    def on_close():
+        # Runs when the response ends, including client disconnects mid-stream
+        # Drop the partial file before releasing the claim so no new download races it
+        upstream.close()
+        if not state["complete"]:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+        with audio_lock:
+            downloads_in_flight.discard(key)
+        if not state["complete"]:
+            logger.info(f"[TEE] Client stopped early, caching {song_id} in background")
+            submit_audio_download(url, song_id, quality, song_metadata)
+    
+    headers = {}
+    # Only forward the length if iter_content won't change it by decoding
+    if "Content-Length" in upstream.headers and "Content-Encoding" not in upstream.headers:
+        headers["Content-Length"] = upstream.headers["Content-Length"]
+    mimetype = "audio/flac" if audio_path.endswith(".flac") else "audio/mpeg"
+    response = Response(generate(), mimetype=mimetype, headers=headers)
+    response.call_on_close(on_close)
+    return response
+
+
+# Cover art cache: proxied images stored on disk, keyed by sha1 of the upstream URL
+COVER_CACHE_DIR = os.path.join(DATA_DIR, "covers")
+os.makedirs(COVER_CACHE_DIR, exist_ok=True)
+COVER_CLEANUP_EVERY = 100  # Check the cover cache size after this many new files
+_cover_writes = itertools.count(1)  # next() is atomic, so no lock is needed
+
+def get_cover_cache_path(cover_url: str) -> str:
+    """Get the local file path for a cached cover image"""
+    ext = ".png" if cover_url.endswith(".png") else ".jpg"
+    return os.path.join(COVER_CACHE_DIR, hashlib.sha1(cover_url.encode()).hexdigest() + ext)
+
+def stream_cover_to_cache(resp, path: str):
+    """Yield an upstream image in chunks while saving it to the cover cache"""
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    complete = False
+    try:
+        with open(temp_path, 'wb') as f:
+            for chunk in resp.iter_content(chunk_size=8192):
+                f.write(chunk)
+                yield chunk
+        os.replace(temp_path, path)
+        complete = True
+    finally:
+        if not complete:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+    if next(_cover_writes) % COVER_CLEANUP_EVERY == 0:
+        upstream_pool.submit(cleanup_cover_cache)
+
+# Cover temp files older than this belong to a dead request and are removed on cleanup
+COVER_TEMP_MAX_AGE = 60 * 60
+
+def cleanup_cover_cache():
+    """Delete oldest cover images if the cover cache exceeds COVER_CACHE_MAX_SIZE"""
     try:
-        total_size = get_audio_cache_size()
-        if total_size <= AUDIO_CACHE_MAX_SIZE:
-            return
-        
-        logger.info(f"[CACHE] Size {total_size / 1024 / 1024 / 1024:.2f} GB exceeds limit {AUDIO_CACHE_MAX_SIZE / 1024 / 1024 / 1024:.2f} GB, cleaning up...")
-        
-        # Get all files sorted by modification time (oldest first)
         files = []
-        for f in os.listdir(AUDIO_CACHE_DIR):
-            path = os.path.join(AUDIO_CACHE_DIR, f)
-            if os.path.isfile(path) and not f.endswith('.tmp'):
-                files.append((path, os.path.getmtime(path), os.path.getsize(path)))
-        
-        files.sort(key=lambda x: x[1])  # Sort by mtime
+        total = 0
+        stale_before = time.time() - COVER_TEMP_MAX_AGE
+        with os.scandir(COVER_CACHE_DIR) as it:
+            for entry in it:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                if entry.name.endswith('.tmp'):
+                    if st.st_mtime < stale_before:
+                        try:
+                            os.remove(entry.path)
+                        except OSError:
+                            pass
+                    continue
+                files.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        if total <= COVER_CACHE_MAX_SIZE:
+            return
         
-        # Delete oldest files until under limit
         deleted_count = 0
-        for path, mtime, size in files:
-            if total_size <= AUDIO_CACHE_MAX_SIZE:
+        for mtime, size, path in sorted(files):
+            if total <= COVER_CACHE_MAX_SIZE:
                 break
-            os.remove(path)
-            total_size -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
             deleted_count += 1
-        
-        logger.info(f"[CACHE] Deleted {deleted_count} old files, new size: {total_size / 1024 / 1024 / 1024:.2f} GB")
+        logger.info(f"[CACHE] Deleted {deleted_count} old covers, new size: {total / 1024 / 1024:.1f} MB")
     except Exception as e:
-        logger.error(f"[CACHE] Cleanup error: {e}")
+        logger.error(f"[CACHE] Cover cleanup error: {e}")
 
 
 # Helper function to strip platform prefix from artist/album names
+# Display prefixes added by search results; one anchored alternation, matched in C
+PLATFORM_PREFIX_PATTERN = re.compile(r'^(?:网易云 - |QQ - |酷我 - )')
+
+@lru_cache(maxsize=4096)  # Artist names repeat across playlists, searches and lyric polls
 def strip_platform_prefix(name: str) -> str:
     """Remove platform prefix like 'QQ - ' or '网易云 - ' from name"""
-    prefixes = ["网易云 - ", "QQ - ", "酷我 - "]
-    for prefix in prefixes:
-        if name.startswith(prefix):
-            return name[len(prefix):]
-    return name
-
-
-# Pending requests (to prevent duplicate API calls)
-pending_requests = set()
+    return PLATFORM_PREFIX_PATTERN.sub('', name, count=1)
+
+
+# Pending requests (to prevent duplicate API calls): cache_key -> Event set when the parse finishes
+pending_requests = {}
+
+def load_once(cache_key: str, cache: dict, loader, timeout: float = 10):
+    """Run loader() for a cache miss, or wait for the request already running it and read its result from cache"""
+    pending_event = threading.Event()
+    other_event = pending_requests.setdefault(cache_key, pending_event)
+    if other_event is not pending_event:
+        logger.info(f"[PENDING] Request already in progress for {cache_key}, waiting...")
+        if other_event.wait(timeout=timeout):
+            cached_data = get_cached(cache, cache_key)
+            if cached_data:
+                return cached_data
+        # The other request failed or is too slow - load it ourselves
+        return loader()
+    try:
+        return loader()
+    finally:
+        if pending_requests.get(cache_key) is pending_event:
+            pending_requests.pop(cache_key, None)
+        pending_event.set()
 
 CACHE_FILE = os.path.join(DATA_DIR, "server_cache.json")
 
+def json_dumps_bytes(obj) -> bytes:
+    """Serialize to compact UTF-8 JSON bytes"""
+    return orjson.dumps(obj)
+
+def json_loads(data):
+    """Parse JSON from bytes/str"""
+    return orjson.loads(data)
+
+# Files at least this large are parsed straight from a memory map instead of a read() copy
+JSON_MMAP_MIN_SIZE = 1 << 20
+
+def read_json_file(f):
+    """Parse an open binary JSON file; large files are parsed straight from an mmap"""
+    if os.fstat(f.fileno()).st_size >= JSON_MMAP_MIN_SIZE:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                return orjson.loads(view)
+    return json_loads(f.read())
+
+def _normalize_cache_entries(entries: dict) -> dict:
+    """Convert loaded [data, timestamp] entries to tuples, dropping malformed ones"""
+    return {
+        k: (v[0], v[1]) for k, v in entries.items()
+        if isinstance(v, list) and len(v) == 2
+    }
+
 def load_cache():
     """Load cache from disk"""
     global playlist_cache, stream_url_cache, song_metadata_cache
     try:
         if os.path.exists(CACHE_FILE):
-            with open(CACHE_FILE, 'r') as f:
-                data = json.load(f)
-                playlist_cache = data.get('playlists', {})
-                stream_url_cache = data.get('streams', {})
-                song_metadata_cache = data.get('metadata', {})
+            with open(CACHE_FILE, 'rb') as f:
+                data = read_json_file(f)
+                # JSON stores entries as [data, timestamp] lists; normalize them to
+                # (data, timestamp) tuples once here so get_cached can unpack blindly
+                playlist_cache = _normalize_cache_entries(data.get('playlists', {}))
+                stream_url_cache = _normalize_cache_entries(data.get('streams', {}))
+                song_metadata_cache = _normalize_cache_entries(data.get('metadata', {}))
                 
                 # Clear cached playlist list to force fresh API call with current config
                 # This ensures config changes take effect immediately
@@ -198,45 +654,72 @@ def load_cache():
 
 def save_cache():
     """Save cache to disk"""
-    with cache_lock:
-        try:
-            data = {
-                'playlists': playlist_cache,
-                'streams': stream_url_cache,
-                'metadata': song_metadata_cache
-            }
-            with open(CACHE_FILE, 'w') as f:
-                json.dump(data, f)
-            logger.info("Saved cache to disk")
-        except Exception as e:
-            logger.error(f"Failed to save cache: {e}")
+    try:
+        # dict() copies each cache in one C call (atomic under the GIL), so no lock is
+        # needed; serialize and write from the snapshots
+        data = {
+            'playlists': dict(playlist_cache),
+            'streams': dict(stream_url_cache),
+            'metadata': dict(song_metadata_cache)
+        }
+        payload = json_dumps_bytes(data)
+        # Write to a per-thread temp file, then rename, so a crash never leaves a torn
+        # cache file (the writer thread, refresher and atexit may all save)
+        temp_file = f"{CACHE_FILE}.{threading.get_ident()}.tmp"
+        with open(temp_file, 'wb') as f:
+            f.write(payload)
+        os.replace(temp_file, CACHE_FILE)
+        logger.info("Saved cache to disk")
+    except Exception as e:
+        logger.error(f"Failed to save cache: {e}")
+
+# ============ Debounced Cache Persistence ============
+# Request handlers mark the cache dirty instead of writing it themselves; a
+# background thread coalesces bursts into one save every CACHE_SAVE_DELAY seconds.
+CACHE_SAVE_DELAY = 5
+_cache_dirty = threading.Event()
+
+def request_cache_save():
+    """Schedule a cache save on the background writer thread"""
+    _cache_dirty.set()
+
+def cache_writer():
+    """Background task that persists the cache after it has been marked dirty"""
+    while True:
+        _cache_dirty.wait()
+        time.sleep(CACHE_SAVE_DELAY)
+        _cache_dirty.clear()
+        save_cache()
+
+def start_cache_writer():
+    """Start the background cache writer thread"""
+    threading.Thread(target=cache_writer, daemon=True, name="CacheWriter").start()
 
 # ============ Scheduled Playlist Refresh ============
-PLAYLIST_REFRESH_INTERVAL = int(os.environ.get("PLAYLIST_REFRESH_HOURS", "3")) * 60 * 60  # Default: 3 hours
+# playlist_cache key prefixes dropped by each scheduled refresh
+REFRESHED_PLAYLIST_PREFIXES = ('playlists_', 'playlist_detail_')
 
 def refresh_playlist_cache():
     """Background task to refresh playlist cache periodically"""
-    import time as time_module
-    
     while True:
         try:
-            time_module.sleep(PLAYLIST_REFRESH_INTERVAL)
+            time.sleep(PLAYLIST_REFRESH_INTERVAL)
             logger.info(f"[SCHEDULED REFRESH] Starting playlist cache refresh...")
             
-            # Clear all playlist caches to force fresh API calls
-            with cache_lock:
-                keys_to_remove = [k for k in playlist_cache if k.startswith(('playlists_', 'netease_', 'qq_', 'kuwo_'))]
-                removed_count = 0
-                for k in keys_to_remove:
-                    del playlist_cache[k]
+            # Clear all playlist caches to force fresh API calls. The key scan runs on a
+            # snapshot; each pop() is atomic, so readers are never blocked.
+            keys_to_remove = [k for k in list(playlist_cache) if k.startswith(REFRESHED_PLAYLIST_PREFIXES)]
+            removed_count = 0
+            for k in keys_to_remove:
+                if playlist_cache.pop(k, None) is not None:
                     removed_count += 1
             
             if removed_count > 0:
                 logger.info(f"[SCHEDULED REFRESH] Cleared {removed_count} playlist cache entries")
                 save_cache()
+            tunehub_client.invalidate_toplists()
             
             # Pre-fetch playlists for all configured platforms
-            from config import ALLOWED_PLAYLISTS
             for platform, playlist_ids in ALLOWED_PLAYLISTS.items():
                 if not playlist_ids:
                     continue
@@ -250,20 +733,21 @@ def refresh_playlist_cache():
                         tid = toplist.get('id', '')
                         if tid in playlist_ids:
                             try:
-                                detail = tunehub_client.get_toplist_detail(platform, tid)
-                                song_count = len(detail.get('songs', []))
-                                cache_key = f"{platform}_{tid}"
-                                set_cached(playlist_cache, cache_key, {
-                                    'info': toplist,
-                                    'songs': detail.get('songs', [])
-                                })
-                                logger.info(f"[SCHEDULED REFRESH] Cached {cache_key} with {song_count} songs")
+                                # Same loader as getPlaylist: warms the entry it reads and seeds
+                                # every song's metadata in one batched cache update
+                                playlist_id = f"{platform}_{tid}"
+                                detail = load_playlist_detail(playlist_id, f"playlist_detail_{playlist_id}")
+                                song_count = len(detail['songs'])
+                                logger.info(f"[SCHEDULED REFRESH] Cached {playlist_id} with {song_count} songs")
                             except Exception as e:
                                 logger.error(f"[SCHEDULED REFRESH] Failed to fetch {platform}_{tid}: {e}")
                 except Exception as e:
                     logger.error(f"[SCHEDULED REFRESH] Failed to fetch toplists for {platform}: {e}")
             
             save_cache()
+            
+            # Rebuild served M3U playlists so they never expire in front of a listener
+            refresh_m3u_cache()
             logger.info(f"[SCHEDULED REFRESH] Completed. Next refresh in {PLAYLIST_REFRESH_INTERVAL // 3600} hours")
             
         except Exception as e:
@@ -279,137 +763,315 @@ def start_playlist_refresh_scheduler():
 
 
 # ============ User Data Storage (Playlists, Starred, Ratings) ============
-USER_DATA_FILE = os.path.join(DATA_DIR, "user_data.json")
+# SQLite (WAL) instead of one JSON file, so each star/rating/playlist change writes
+# one row instead of rewriting everything. The in-memory structures below stay the
+# read path; every change is written through with the save_*/delete_* helpers.
+USER_DB_FILE = os.path.join(DATA_DIR, "user_data.db")
+USER_DATA_FILE = os.path.join(DATA_DIR, "user_data.json")  # Legacy format, migrated on first start
 
 # User data structures
 user_playlists = {}  # {playlist_id: {name, songs: [song_ids], created}}
 starred_songs = set()  # Set of song IDs
 song_ratings = {}  # {song_id: rating (1-5)}
 
+# Lock for user data operations (also serializes use of the shared connection)
+user_data_lock = threading.Lock()
+user_db = None
+
+def open_user_db():
+    """Open the user data database and create its tables"""
+    db = sqlite3.connect(USER_DB_FILE, check_same_thread=False, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("CREATE TABLE IF NOT EXISTS playlists (id TEXT PRIMARY KEY, name TEXT, songs TEXT, created REAL)")
+    db.execute("CREATE TABLE IF NOT EXISTS starred (song_id TEXT PRIMARY KEY)")
+    db.execute("CREATE TABLE IF NOT EXISTS ratings (song_id TEXT PRIMARY KEY, rating INTEGER)")
+    return db
+
+def _migrate_user_data_json(db):
+    """Import the old user_data.json into the database once, keeping the file as .bak"""
+    with open(USER_DATA_FILE, 'rb') as f:
+        data = json_loads(f.read())
+    with db:
+        db.execute("BEGIN")
+        db.executemany("INSERT OR REPLACE INTO playlists VALUES (?, ?, ?, ?)", [
+            (pl_id, pl.get("name", ""), json.dumps(pl.get("songs", []), ensure_ascii=False), pl.get("created", 0))
+            for pl_id, pl in data.get('playlists', {}).items()
+        ])
+        db.executemany("INSERT OR REPLACE INTO starred VALUES (?)", [(sid,) for sid in data.get('starred', [])])
+        db.executemany("INSERT OR REPLACE INTO ratings VALUES (?, ?)", list(data.get('ratings', {}).items()))
+    os.replace(USER_DATA_FILE, USER_DATA_FILE + ".bak")
+    logger.info(f"Migrated {USER_DATA_FILE} to {USER_DB_FILE}")
+
 def load_user_data():
     """Load user data from disk"""
-    global user_playlists, starred_songs, song_ratings
+    global user_db, user_playlists, starred_songs, song_ratings
     try:
+        user_db = open_user_db()
         if os.path.exists(USER_DATA_FILE):
-            with open(USER_DATA_FILE, 'r') as f:
-                data = json.load(f)
-                user_playlists = data.get('playlists', {})
-                starred_songs = set(data.get('starred', []))
-                song_ratings = data.get('ratings', {})
-                logger.info(f"Loaded user data: {len(user_playlists)} playlists, {len(starred_songs)} starred, {len(song_ratings)} ratings")
+            _migrate_user_data_json(user_db)
+        user_playlists = {
+            pl_id: {"name": name, "songs": json.loads(songs), "created": created}
+            for pl_id, name, songs, created in user_db.execute("SELECT id, name, songs, created FROM playlists")
+        }
+        starred_songs = {sid for (sid,) in user_db.execute("SELECT song_id FROM starred")}
+        song_ratings = dict(user_db.execute("SELECT song_id, rating FROM ratings"))
+        logger.info(f"Loaded user data: {len(user_playlists)} playlists, {len(starred_songs)} starred, {len(song_ratings)} ratings")
     except Exception as e:
         logger.error(f"Failed to load user data: {e}")
 
-# Lock for user data operations
-user_data_lock = threading.Lock()
-
-def save_user_data():
-    """Save user data to disk"""
+def _write_user_db(sql: str, params: tuple):
+    """Run one write statement against the user database (autocommit)"""
+    if user_db is None:
+        return
     with user_data_lock:
         try:
-            data = {
-                'playlists': dict(user_playlists),  # Copy to avoid race
-                'starred': list(starred_songs),
-                'ratings': dict(song_ratings)
-            }
-            # Write to temp file first, then rename (atomic operation)
-            temp_file = USER_DATA_FILE + ".tmp"
-            with open(temp_file, 'w') as f:
-                json.dump(data, f, indent=2)
-            os.replace(temp_file, USER_DATA_FILE)
-            logger.info("Saved user data to disk")
+            user_db.execute(sql, params)
         except Exception as e:
             logger.error(f"Failed to save user data: {e}")
 
+def save_playlist(playlist_id: str):
+    """Persist one user playlist from user_playlists"""
+    pl = user_playlists[playlist_id]
+    _write_user_db("INSERT OR REPLACE INTO playlists VALUES (?, ?, ?, ?)",
+                   (playlist_id, pl["name"], json.dumps(pl["songs"], ensure_ascii=False), pl["created"]))
+
+def delete_saved_playlist(playlist_id: str):
+    """Remove one user playlist from the database"""
+    _write_user_db("DELETE FROM playlists WHERE id = ?", (playlist_id,))
+
+def save_starred(song_id: str, starred: bool):
+    """Persist a star/unstar"""
+    if starred:
+        _write_user_db("INSERT OR IGNORE INTO starred VALUES (?)", (song_id,))
+    else:
+        _write_user_db("DELETE FROM starred WHERE song_id = ?", (song_id,))
+
+def save_rating(song_id: str, rating: int):
+    """Persist a rating; 0 removes it"""
+    if rating > 0:
+        _write_user_db("INSERT OR REPLACE INTO ratings VALUES (?, ?)", (song_id, rating))
+    else:
+        _write_user_db("DELETE FROM ratings WHERE song_id = ?", (song_id,))
+
 # ============ Credits Usage Logging ============
-CREDITS_LOG_FILE = os.path.join(DATA_DIR, "credits_log.json")
-credits_log = []  # List of credit usage records
+# Append-only, one JSON record per line, so logging a play never rewrites the file
+CREDITS_LOG_FILE = os.path.join(DATA_DIR, "credits_log.jsonl")
+LEGACY_CREDITS_LOG_FILE = os.path.join(DATA_DIR, "credits_log.json")  # Old single JSON array
+credits_log = []  # List of credit usage records, oldest first
+credits_dates = []  # credits_log[i]["date"], kept in lockstep for bisect range queries
+
+# Low-cardinality record fields whose values are shared between records via sys.intern
+_INTERNED_CREDIT_FIELDS = frozenset({"date", "platform", "quality"})
+
+def _intern_credit_record(record: dict) -> dict:
+    """Rebuild a loaded record with interned keys and repeated values
+
+    Records parsed line by line get fresh key strings each; interning lets tens of
+    thousands of records share one copy of every key and of "netease"/"flac"/dates.
+    """
+    return {
+        sys.intern(key): sys.intern(value) if key in _INTERNED_CREDIT_FIELDS and isinstance(value, str) else value
+        for key, value in record.items()
+    }
 
 def load_credits_log():
-    """Load credits log from disk"""
-    global credits_log
+    """Load credits log from disk, migrating the old JSON array file if needed"""
+    global credits_log, credits_dates
     try:
         if os.path.exists(CREDITS_LOG_FILE):
-            with open(CREDITS_LOG_FILE, 'r') as f:
-                credits_log = json.load(f)
-                logger.info(f"[CREDITS] Loaded {len(credits_log)} credit usage records")
+            records = []
+            bad_lines = 0
+            with open(CREDITS_LOG_FILE, 'rb') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        records.append(_intern_credit_record(json_loads(line)))
+                    except ValueError:
+                        bad_lines += 1  # e.g. a torn last line after a crash
+            credits_log = records
+            if bad_lines:
+                logger.warning(f"[CREDITS] Skipped {bad_lines} malformed lines, compacting log")
+                compact_credits_log()
+        elif os.path.exists(LEGACY_CREDITS_LOG_FILE):
+            with open(LEGACY_CREDITS_LOG_FILE, 'rb') as f:
+                credits_log = [_intern_credit_record(record) for record in json_loads(f.read())]
+            compact_credits_log()
+            logger.info(f"[CREDITS] Migrated {LEGACY_CREDITS_LOG_FILE} to {CREDITS_LOG_FILE}")
+        # Stable sort keeps same-day order and guarantees credits_dates is sorted
+        credits_log.sort(key=lambda record: record.get("date", ""))
+        credits_dates = [record.get("date", "") for record in credits_log]
+        logger.info(f"[CREDITS] Loaded {len(credits_log)} credit usage records")
     except Exception as e:
         logger.error(f"Failed to load credits log: {e}")
 
 credits_log_lock = threading.Lock()
 
-def save_credits_log():
-    """Save credits log to disk"""
+# Encoded JSON lines waiting to be appended to CREDITS_LOG_FILE by the background writer
+credits_write_queue = queue.SimpleQueue()
+_credits_pending = threading.Event()
+
+def _drain_credits_queue() -> list:
+    """Take every queued credits log line (caller holds credits_log_lock)"""
+    lines = []
+    while True:
+        try:
+            lines.append(credits_write_queue.get_nowait())
+        except queue.Empty:
+            return lines
+
+def flush_credits_log():
+    """Append all queued credit records to the log file in one write"""
     with credits_log_lock:
+        lines = _drain_credits_queue()
+        if not lines:
+            return
         try:
-            with open(CREDITS_LOG_FILE, 'w') as f:
-                json.dump(credits_log, f, indent=2, ensure_ascii=False)
+            with open(CREDITS_LOG_FILE, 'ab') as f:
+                f.write(b"".join(lines))
         except Exception as e:
-            logger.error(f"Failed to save credits log: {e}")
+            logger.error(f"Failed to append credits log: {e}")
+
+def credits_log_writer():
+    """Background task that appends queued credit records, off the request path"""
+    while True:
+        _credits_pending.wait()
+        _credits_pending.clear()
+        flush_credits_log()
+
+def start_credits_log_writer():
+    """Start the background credits log writer thread"""
+    threading.Thread(target=credits_log_writer, daemon=True, name="CreditsLogWriter").start()
+
+def compact_credits_log():
+    """Rewrite the credits log file from the in-memory records"""
+    with credits_log_lock:
+        _drain_credits_queue()  # Queued lines are already in credits_log
+        try:
+            temp_path = CREDITS_LOG_FILE + ".tmp"
+            with open(temp_path, 'wb') as f:
+                f.writelines(json_dumps_bytes(record) + b"\n" for record in credits_log)
+            os.replace(temp_path, CREDITS_LOG_FILE)
+        except Exception as e:
+            logger.error(f"Failed to compact credits log: {e}")
+
+def get_credits_in_range(start_date: str, end_date: str) -> list:
+    """Records with start_date <= date <= end_date (YYYY-MM-DD), via bisect on credits_dates"""
+    with credits_log_lock:
+        lo = bisect.bisect_left(credits_dates, start_date)
+        hi = bisect.bisect_right(credits_dates, end_date)
+        return credits_log[lo:hi]
 
 def log_credit_usage(platform: str, song_id: str, title: str, artist: str, file_size: int = 0, quality: str = ""):
     """Record a credit usage event"""
-    from datetime import datetime
     
+    now = datetime.now()
     record = {
-        "timestamp": datetime.now().isoformat(),
-        "date": datetime.now().strftime("%Y-%m-%d"),
-        "time": datetime.now().strftime("%H:%M:%S"),
-        "platform": platform,
+        "timestamp": now.isoformat(),
+        "date": sys.intern(now.strftime("%Y-%m-%d")),
+        "time": now.strftime("%H:%M:%S"),
+        "platform": sys.intern(platform),
         "song_id": song_id,
         "title": title,
         "artist": artist,
         "file_size": file_size,
         "file_size_mb": round(file_size / 1024 / 1024, 2) if file_size else 0,
-        "quality": quality
+        "quality": sys.intern(quality)
     }
     
+    line = json_dumps_bytes(record) + b"\n"
     with credits_log_lock:
         credits_log.append(record)
-    
-    # Save asynchronously
-    import threading
-    threading.Thread(target=save_credits_log, daemon=True).start()
+        credits_dates.append(record["date"])
+        # Appended to the file by the writer thread instead of rewriting the whole log
+        credits_write_queue.put(line)
+    _credits_pending.set()
     
     logger.info(f"[CREDITS] Logged: {platform}:{song_id} - {artist} - {title}")
 
 # ============ Initialize Data (only in worker process, not reloader parent) ============
-import os as _os
-_is_werkzeug_reloader_parent = app.debug and _os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+_is_werkzeug_reloader_parent = app.debug and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
 
 if not _is_werkzeug_reloader_parent:
     # Worker process or non-debug mode: load data and register save on exit
+    build_audio_index()
+    start_audio_cleanup_worker()
+    _audio_cleanup_needed.set()  # Apply a lowered AUDIO_CACHE_MAX_SIZE right away
     load_cache()
+    start_cache_writer()
     atexit.register(save_cache)
     load_user_data()
-    atexit.register(save_user_data)
     load_credits_log()
-    atexit.register(save_credits_log)
+    start_credits_log_writer()
+    atexit.register(flush_credits_log)
     logger.info("Cache, user data, and credits log initialized (worker process)")
 else:
     # Reloader parent: do NOT load or save - let worker handle it
     logger.info("Skipping data init (reloader parent process)")
 
 def get_cached(cache: dict, key: str, ttl: int = CACHE_DURATION):
-    """Get cached value if not expired"""
-    with cache_lock:
-        key = str(key)
-        if key in cache:
-            entry = cache[key]
-            # Handle list format [data, timestamp] from JSON
-            if isinstance(entry, list) and len(entry) == 2:
-                data, timestamp = entry
-                if time.time() - timestamp < ttl:
-                    return data
-                else:
-                    # Expired
-                    del cache[key]
+    """Get cached value if not expired
+    
+    Reads and writes are lock-free (single dict get/set/update calls are atomic
+    under the GIL); a striped lock is only taken to evict an expired entry.
+    """
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    data, timestamp = entry
+    if time.time() - timestamp < ttl:
+        return data
+    # Expired - evict unless a writer replaced it in the meantime
+    with _evict_locks[hash(key) % EVICT_LOCK_STRIPES]:
+        if cache.get(key) is entry:
+            del cache[key]
     return None
 
 def set_cached(cache: dict, key: str, data):
-    """Set cache with current timestamp"""
-    with cache_lock:
-        cache[str(key)] = [data, time.time()]
+    """Set cache with current timestamp (key must already be a str)"""
+    cache[key] = (data, time.time())
+
+def set_cached_bulk(cache: dict, items: dict):
+    """Set many cache entries with one dict.update()"""
+    if not items:
+        return
+    now = time.time()
+    cache.update({key: (data, now) for key, data in items.items()})
+
+
+# Password as bytes, encoded once for token checks
+_SUBSONIC_PASSWORD_BYTES = SUBSONIC_PASSWORD.encode()
+
+@lru_cache(maxsize=256)
+def _token_for_salt(salt: str) -> bytes:
+    """Expected Subsonic auth token md5(password + salt) as hex bytes; clients reuse salts across a session"""
+    # Protocol-mandated md5, not used as a security primitive here; skips FIPS policy checks
+    return hashlib.md5(_SUBSONIC_PASSWORD_BYTES + salt.encode(), usedforsecurity=False).hexdigest().encode()
+
+
+# Recently accepted credentials (u, p, t, s), so repeat calls (ping is polled
+# constantly) skip decoding and hashing. Only successful logins are stored.
+AUTH_CACHE_SIZE = 512
+_auth_cache = OrderedDict()
+_auth_cache_lock = threading.Lock()
+
+def _remember_auth(key: tuple):
+    """Record accepted credentials, evicting the oldest entry when full"""
+    with _auth_cache_lock:
+        _auth_cache[key] = True
+        if len(_auth_cache) > AUTH_CACHE_SIZE:
+            _auth_cache.popitem(last=False)
+
+
+def subsonic_route(*names, methods=("GET",)):
+    """Register a view under /rest/<name> and the legacy /rest/<name>.view for each name"""
+    def decorator(f):
+        for name in names:
+            app.add_url_rule(f"/rest/{name}", view_func=f, methods=methods)
+            app.add_url_rule(f"/rest/{name}.view", view_func=f, methods=methods)
+        return f
+    return decorator
 
 
 def require_auth(f):
@@ -422,6 +1084,11 @@ def require_auth(f):
         token = request.args.get("t", "")
         salt = request.args.get("s", "")
         
+        # Fast path: credentials already accepted (lock-free read)
+        auth_key = (username, password, token, salt)
+        if auth_key in _auth_cache:
+            return f(*args, **kwargs)
+        
         # Validate authentication
         auth_valid = False
         
@@ -433,12 +1100,13 @@ def require_auth(f):
                     password = bytes.fromhex(password[4:]).decode("utf-8")
                 except:
                     pass
-            auth_valid = (username == SUBSONIC_USER and password == SUBSONIC_PASSWORD)
+            auth_valid = (username == SUBSONIC_USER and
+                          hmac.compare_digest(password.encode(), _SUBSONIC_PASSWORD_BYTES))
         
         elif token and salt:
             # Token-based auth: token = md5(password + salt)
-            expected_token = hashlib.md5((SUBSONIC_PASSWORD + salt).encode()).hexdigest()
-            auth_valid = (username == SUBSONIC_USER and token.lower() == expected_token.lower())
+            auth_valid = (username == SUBSONIC_USER and
+                          hmac.compare_digest(token.lower().encode(), _token_for_salt(salt)))
         
         if not auth_valid:
             resp_format = request.args.get("f", "xml")
@@ -446,6 +1114,7 @@ def require_auth(f):
             content, content_type = format_response(error, resp_format)
             return Response(content, status=401, content_type=content_type)
         
+        _remember_auth(auth_key)
         return f(*args, **kwargs)
     return decorated_function
 
@@ -462,64 +1131,43 @@ def make_response_from_element(element) -> Response:
     return Response(content, content_type=content_type)
 
 
+def make_etag_response(content, content_type: str) -> Response:
+    """Create Flask Response tagged with a content hash; answers 304 if the client already has it"""
+    body = content.encode("utf-8") if isinstance(content, str) else content
+    response = Response(body, content_type=content_type)
+    response.set_etag(hashlib.blake2b(body, digest_size=8).hexdigest())
+    return response.make_conditional(request)
+
+
+def prerender_response(element) -> dict:
+    """Serialize a constant response once per format: {"xml"|"json": (bytes, content_type)}"""
+    rendered = {}
+    for resp_format in ("xml", "json"):
+        content, content_type = format_response(element, resp_format)
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        rendered[resp_format] = (content, content_type)
+    return rendered
+
+
+def make_prerendered_response(rendered: dict) -> Response:
+    """Create Flask Response from a prerender_response() result"""
+    content, content_type = rendered["json" if get_response_format() == "json" else "xml"]
+    return Response(content, content_type=content_type)
+
+
+# Parameter-free endpoints (ping is polled constantly) - serialized once at import
+PING_RESPONSE = prerender_response(format_ping())
+LICENSE_RESPONSE = prerender_response(format_license())
+MUSIC_FOLDERS_RESPONSE = prerender_response(format_music_folders())
+INDEXES_RESPONSE = prerender_response(format_indexes())
+
+
 # ============ Web Dashboard ============
 
-@app.route("/")
-@app.route("/dashboard")
-def credits_dashboard():
-    """Credits usage dashboard with date filtering"""
-    from datetime import datetime, timedelta
-    
-    # Get date parameters
-    start_date = request.args.get("start_date", datetime.now().strftime("%Y-%m-%d"))
-    end_date = request.args.get("end_date", start_date)
-    
-    # Filter records by date
-    filtered_records = []
-    with credits_log_lock:
-        for record in credits_log:
-            if start_date <= record.get("date", "") <= end_date:
-                filtered_records.append(record)
-    
-    # Calculate totals
-    total_credits = len(filtered_records)
-    platform_counts = {}
-    for r in filtered_records:
-        p = r.get("platform", "unknown")
-        platform_counts[p] = platform_counts.get(p, 0) + 1
-    
-    # Build platform stats HTML (Python 3.11 compatible)
-    platform_stats_html = ""
-    for platform, count in platform_counts.items():
-        platform_stats_html += '<div class="stat-card"><div class="stat-value">{}</div><div class="stat-label">{}</div></div>'.format(count, platform.upper())
-    
-    # Build table rows HTML (Python 3.11 compatible)
-    table_rows_html = ""
-    for r in reversed(filtered_records):
-        row_date = r.get("date", "")
-        row_time = r.get("time", "")
-        row_platform = r.get("platform", "")
-        row_title = r.get("title", "Unknown")
-        row_artist = r.get("artist", "Unknown")
-        row_quality = r.get("quality", "-")
-        table_rows_html += '''<tr>
-            <td>{} {}</td>
-            <td><span class="platform {}">{}</span></td>
-            <td>{}</td>
-            <td>{}</td>
-            <td>{}</td>
-        </tr>'''.format(row_date, row_time, row_platform, row_platform.upper(), row_title, row_artist, row_quality)
-    
-    if not table_rows_html:
-        table_rows_html = '<tr><td colspan="5" class="empty">No records for selected date range</td></tr>'
-    
-    # Date range label
-    date_label = start_date
-    if end_date != start_date:
-        date_label = start_date + " to " + end_date
-    
-    # Generate HTML
-    html = '''<!DOCTYPE html>
+# Page shell built once at import; $placeholders are filled per request
+# (string.Template, so the CSS braces need no escaping)
+DASHBOARD_TEMPLATE = Template('''<!DOCTYPE html>
 <html>
 <head>
     <meta charset="UTF-8">
@@ -624,17 +1272,17 @@ def credits_dashboard():
         
         <div class="stats">
             <div class="stat-card">
-                <div class="stat-value">''' + str(total_credits) + '''</div>
-                <div class="stat-label">Credits Used (''' + date_label + ''')</div>
+                <div class="stat-value">$total_credits</div>
+                <div class="stat-label">Credits Used ($date_label)</div>
             </div>
-            ''' + platform_stats_html + '''
+            $platform_stats
         </div>
         
         <form class="filters" method="get">
             <label>Start Date:</label>
-            <input type="date" name="start_date" value="''' + start_date + '''">
+            <input type="date" name="start_date" value="$start_date">
             <label>End Date:</label>
-            <input type="date" name="end_date" value="''' + end_date + '''">
+            <input type="date" name="end_date" value="$end_date">
             <button type="submit">Filter</button>
             <button type="button" onclick="window.location.href='/'">Today</button>
         </form>
@@ -650,12 +1298,75 @@ def credits_dashboard():
                 </tr>
             </thead>
             <tbody>
-                ''' + table_rows_html + '''
+                $table_rows
             </tbody>
         </table>
     </div>
 </body>
-</html>'''
+</html>''')
+
+DASHBOARD_ROW = '''<tr>
+            <td>{} {}</td>
+            <td><span class="platform {}">{}</span></td>
+            <td>{}</td>
+            <td>{}</td>
+            <td>{}</td>
+        </tr>'''
+
+@app.route("/")
+@app.route("/dashboard")
+def credits_dashboard():
+    """Credits usage dashboard with date filtering"""
+    
+    # Get date parameters
+    start_date = request.args.get("start_date", datetime.now().strftime("%Y-%m-%d"))
+    end_date = request.args.get("end_date", start_date)
+    
+    # Filter records by date
+    filtered_records = get_credits_in_range(start_date, end_date)
+    
+    # Calculate totals
+    total_credits = len(filtered_records)
+    platform_counts = {}
+    for r in filtered_records:
+        p = r.get("platform", "unknown")
+        platform_counts[p] = platform_counts.get(p, 0) + 1
+    
+    # Build platform stats HTML
+    platform_stats_html = "".join(
+        '<div class="stat-card"><div class="stat-value">{}</div><div class="stat-label">{}</div></div>'.format(count, html_escape(platform.upper()))
+        for platform, count in platform_counts.items()
+    )
+    
+    # Build table rows HTML - joined once instead of += per record
+    rows = []
+    append_row = rows.append
+    for r in reversed(filtered_records):
+        row_platform = html_escape(r.get("platform", ""))
+        append_row(DASHBOARD_ROW.format(
+            html_escape(r.get("date", "")), html_escape(r.get("time", "")),
+            row_platform, row_platform.upper(),
+            html_escape(r.get("title", "Unknown")), html_escape(r.get("artist", "Unknown")),
+            html_escape(r.get("quality", "-")),
+        ))
+    table_rows_html = "".join(rows)
+    
+    if not table_rows_html:
+        table_rows_html = '<tr><td colspan="5" class="empty">No records for selected date range</td></tr>'
+    
+    # Date range label
+    date_label = start_date
+    if end_date != start_date:
+        date_label = start_date + " to " + end_date
+    
+    html = DASHBOARD_TEMPLATE.substitute(
+        total_credits=total_credits,
+        date_label=html_escape(date_label),
+        platform_stats=platform_stats_html,
+        start_date=html_escape(start_date),
+        end_date=html_escape(end_date),
+        table_rows=table_rows_html,
+    )
     
     return Response(html, content_type='text/html; charset=utf-8')
 
@@ -663,16 +1374,11 @@ def credits_dashboard():
 @app.route("/api/credits")
 def api_credits():
     """JSON API for credits usage data"""
-    from datetime import datetime
     
     start_date = request.args.get("start_date", datetime.now().strftime("%Y-%m-%d"))
     end_date = request.args.get("end_date", start_date)
     
-    filtered_records = []
-    with credits_log_lock:
-        for record in credits_log:
-            if start_date <= record.get("date", "") <= end_date:
-                filtered_records.append(record)
+    filtered_records = get_credits_in_range(start_date, end_date)
     
     return Response(
         json.dumps({
@@ -687,24 +1393,21 @@ def api_credits():
 
 # ============ System Endpoints ============
 
-@app.route("/rest/ping", methods=["GET"])
-@app.route("/rest/ping.view", methods=["GET"])
+@subsonic_route("ping")
 @require_auth
 def ping():
     """Test connectivity with the server"""
-    return make_response_from_element(format_ping())
+    return make_prerendered_response(PING_RESPONSE)
 
 
-@app.route("/rest/getLicense", methods=["GET"])
-@app.route("/rest/getLicense.view", methods=["GET"])
+@subsonic_route("getLicense")
 @require_auth
 def get_license():
     """Get license information"""
-    return make_response_from_element(format_license())
+    return make_prerendered_response(LICENSE_RESPONSE)
 
 
-@app.route("/rest/getOpenSubsonicExtensions", methods=["GET"])
-@app.route("/rest/getOpenSubsonicExtensions.view", methods=["GET"])
+@subsonic_route("getOpenSubsonicExtensions")
 @require_auth
 def get_opensubsonic_extensions():
     """Return supported OpenSubsonic extensions - required for Amperfy lyrics"""
@@ -721,44 +1424,136 @@ def get_opensubsonic_extensions():
     return make_response_from_element(root)
 
 
-def parse_lrc_to_lines(lrc_text: str):
+# Match [mm:ss.xx] or [mm:ss:xx] or [mm:ss] patterns
+# Anchored per line (MULTILINE), so finditer() walks the whole text without splitting it first
+LRC_LINE_PATTERN = re.compile(r'^[^\S\n]*\[(\d{1,2}):(\d{2})(?:[.:](\d{1,3}))?\]([^\n]*)', re.MULTILINE)
+# Non-blank lines that don't start with '[' (unsynced lyrics), stripped, in one C-level scan
+PLAIN_LYRIC_LINE_PATTERN = re.compile(r'^(?!\[)[^\S\n]*(\S[^\n]*?)[^\S\n]*$', re.MULTILINE)
+
+# Clients re-request lyrics for the song that is playing; the same cached lrc_text
+# object comes back each time, so hits cost a cached hash and an identity check
+@lru_cache(maxsize=256)
+def parse_lrc_to_lines(lrc_text: str) -> tuple:
     """Parse LRC format to structured lyrics lines
     
     LRC format: [mm:ss.xx]Lyrics text
-    Returns list of dicts: [{"start": milliseconds, "value": "text"}, ...]
+    Returns (milliseconds, text) tuples: ((12340, "text"), ...), shared between callers
     """
-    import re
     lines = []
     
-    # Match [mm:ss.xx] or [mm:ss:xx] or [mm:ss] patterns
-    pattern = r'\[(\d{1,2}):(\d{2})(?:[.:](\d{1,3}))?\](.*)'
-    
-    for line in lrc_text.split('\n'):
-        line = line.strip()
-        match = re.match(pattern, line)
-        if match:
-            minutes = int(match.group(1))
-            seconds = int(match.group(2))
-            ms_part = match.group(3)
-            text = match.group(4).strip()
-            
-            # Convert to milliseconds
-            milliseconds = (minutes * 60 + seconds) * 1000
-            if ms_part:
-                # Handle different ms formats (2 or 3 digits)
-                if len(ms_part) == 2:
-                    milliseconds += int(ms_part) * 10
-                else:
-                    milliseconds += int(ms_part)
-            
-            if text:  # Only add non-empty lines
-                lines.append({"start": milliseconds, "value": text})
+    for match in LRC_LINE_PATTERN.finditer(lrc_text):
+        minutes, seconds, ms_part, text = match.groups()
+        text = text.strip()
+        if not text:  # Only add non-empty lines
+            continue
+        
+        # Convert to milliseconds
+        milliseconds = (int(minutes) * 60 + int(seconds)) * 1000
+        if ms_part:
+            # Handle different ms formats (2 or 3 digits)
+            if len(ms_part) == 2:
+                milliseconds += int(ms_part) * 10
+            else:
+                milliseconds += int(ms_part)
+        
+        lines.append((milliseconds, text))
+    
+    return tuple(lines)
+
+
+# Per-platform request headers for the free lyric APIs, built once
+NETEASE_LYRIC_HEADERS = {"Referer": "https://music.163.com/"}
+QQ_LYRIC_HEADERS = {"Referer": "https://y.qq.com/"}
+
+# In-flight free lyric fetches: song_id -> (Event set when done, [lyrics]), so
+# concurrent cold-cache requests for one song share a single upstream call
+lyrics_pending = {}
+
+def fetch_free_lyrics(song_id: str) -> Optional[str]:
+    """Fetch LRC lyrics from the platform's free lyric API (netease/qq), "" if unavailable, None if the request failed
+    
+    Concurrent calls for the same song wait for the first caller's result.
+    """
+    flight = (threading.Event(), [None])
+    # dict.setdefault is atomic, same claim pattern as pending_requests in stream()
+    leader = lyrics_pending.setdefault(song_id, flight)
+    if leader is not flight:
+        done_event, result = leader
+        if done_event.wait(timeout=6):  # a little over the 5s request timeout
+            return result[0]
+        logger.warning(f"[LYRICS] Timed out waiting for in-flight fetch of {song_id}, fetching directly")
+        return _request_free_lyrics(song_id)
+    try:
+        flight[1][0] = _request_free_lyrics(song_id)
+        return flight[1][0]
+    finally:
+        if lyrics_pending.get(song_id) is flight:
+            lyrics_pending.pop(song_id, None)
+        flight[0].set()
+
+# After an empty lookup, skip refetching (and the credit-costing TuneHub fallback) for a day.
+# Kept apart from song_metadata_cache, which must only hold real song records:
+# song_id -> monotonic time of the miss, oldest first, at most LYRICS_MISS_MAX entries
+LYRICS_MISS_TTL = 24 * 60 * 60
+LYRICS_MISS_MAX = 4096
+lyrics_missed_at = {}
+
+def lyrics_recently_missed(song_id: str) -> bool:
+    """True if the last lyric lookup for this song found nothing, less than LYRICS_MISS_TTL ago"""
+    missed_at = lyrics_missed_at.get(song_id)
+    return missed_at is not None and time.monotonic() - missed_at < LYRICS_MISS_TTL
+
+def remember_lyrics_miss(song_id: str):
+    """Record that no lyrics were found for this song"""
+    lyrics_missed_at.pop(song_id, None)  # Re-insert at the end to keep oldest-first order
+    lyrics_missed_at[song_id] = time.monotonic()
+    # Ids come from request params, so bound the dict; losing an entry only costs a refetch
+    while len(lyrics_missed_at) > LYRICS_MISS_MAX:
+        try:
+            lyrics_missed_at.pop(next(iter(lyrics_missed_at)))
+        except (StopIteration, KeyError, RuntimeError):
+            break  # Raced with another writer; the next miss trims again
+    logger.info(f"[LYRICS] No lyrics found for {song_id}, skipping lookups for {LYRICS_MISS_TTL // 3600}h")
+
+def prefetch_lyrics(song_id: str):
+    """Fetch free lyrics for a song and merge them into its cached metadata (runs on upstream_pool)
     
-    return lines
+    Kicked off by stream(), so the player's follow-up getLyrics is a cache hit.
+    """
+    lrc_text = fetch_free_lyrics(song_id)
+    if lrc_text is None:
+        return
+    if not lrc_text:
+        remember_lyrics_miss(song_id)
+        return
+    cached_metadata = get_cached(song_metadata_cache, song_id)
+    if cached_metadata is not None and not cached_metadata.get("lyrics"):
+        # Copy first: the cached dict may be shared with playlist and toplist results
+        set_cached(song_metadata_cache, song_id, {**cached_metadata, "lyrics": lrc_text})
+        logger.info(f"[LYRICS] Prefetched and cached for {song_id}")
+
+def _request_free_lyrics(song_id: str) -> Optional[str]:
+    """Request lyrics through the pooled http_session, so repeat misses reuse the kept-alive connection"""
+    platform, _, actual_id = song_id.partition(":")
+    actual_id = quote(actual_id, safe="")  # ids come from request params
+    try:
+        if platform == "netease":
+            url = f"https://music.163.com/api/song/lyric?id={actual_id}&lv=-1&kv=-1&tv=-1"
+            resp = http_session.get(url, headers=NETEASE_LYRIC_HEADERS, timeout=5)
+            resp.raise_for_status()
+            return json_loads(resp.content).get("lrc", {}).get("lyric", "")
+        elif platform == "qq":
+            url = f"https://c.y.qq.com/lyric/fcgi-bin/fcg_query_lyric_new.fcg?songmid={actual_id}&format=json&nobase64=1"
+            resp = http_session.get(url, headers=QQ_LYRIC_HEADERS, timeout=5)
+            resp.raise_for_status()
+            return json_loads(resp.content).get("lyric", "")
+    except Exception as e:
+        logger.warning(f"[LYRICS] Failed to fetch free {platform} lyrics: {e}")
+        return None
+    return ""
 
 
-@app.route("/rest/getLyricsBySongId", methods=["GET"])
-@app.route("/rest/getLyricsBySongId.view", methods=["GET"])
+@subsonic_route("getLyricsBySongId")
 @require_auth
 def get_lyrics_by_song_id():
     """Get structured lyrics by song ID - OpenSubsonic extension for Amperfy"""
@@ -779,55 +1574,37 @@ def get_lyrics_by_song_id():
         lrc_text = cached_metadata["lyrics"]
         logger.info(f"[LYRICS] Cache hit for {song_id}")
     
-    # If not in cache and is netease, fetch from free API
-    elif song_id.startswith("netease:"):
-        try:
-            import requests
-            actual_id = song_id.split(":")[1]
-            url = f"https://music.163.com/api/song/lyric?id={actual_id}&lv=-1&kv=-1&tv=-1"
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36",
-                "Referer": "https://music.163.com/"
-            }
-            resp = requests.get(url, headers=headers, timeout=5)
-            if resp.ok:
-                data = resp.json()
-                lrc_text = data.get("lrc", {}).get("lyric", "")
-                
-                if lrc_text:
-                    # Cache the lyrics
-                    if not cached_metadata:
-                        cached_metadata = {"id": song_id, "artist": artist, "title": title}
-                    cached_metadata["lyrics"] = lrc_text
-                    set_cached(song_metadata_cache, song_id, cached_metadata)
-                    logger.info(f"[LYRICS] Fetched and cached for {song_id}")
-        except Exception as e:
-            logger.warning(f"[LYRICS] Failed to fetch: {e}")
+    # If not in cache (and not a recent miss), fetch from the platform's free lyric API
+    elif ":" in song_id and not lyrics_recently_missed(song_id):
+        lrc_text = fetch_free_lyrics(song_id)
+        if lrc_text:
+            # Cache the lyrics on a copy (see prefetch_lyrics)
+            base = cached_metadata or {"id": song_id, "artist": artist, "title": title}
+            cached_metadata = {**base, "lyrics": lrc_text}
+            set_cached(song_metadata_cache, song_id, cached_metadata)
+            logger.info(f"[LYRICS] Fetched and cached for {song_id}")
+        elif lrc_text is not None:
+            remember_lyrics_miss(song_id)
+        lrc_text = lrc_text or ""
+    
+    synced, lines = False, []
+    if lrc_text:
+        lines = parse_lrc_to_lines(lrc_text)
+        synced = bool(lines)
+        if synced:
+            logger.info(f"[LYRICS] Returning {len(lines)} synced lines for {song_id}")
+        else:
+            # Check if it's unsynced lyrics (no timestamps)
+            lines = PLAIN_LYRIC_LINE_PATTERN.findall(lrc_text)
+            if lines:
+                logger.info(f"[LYRICS] Returning {len(lines)} unsynced lines for {song_id}")
+    else:
+        logger.info(f"[LYRICS] No lyrics found for {song_id}")
+    display_artist = strip_platform_prefix(artist)
     
-    # If not in cache and is QQ music, fetch from free API
-    elif song_id.startswith("qq:"):
-        try:
-            import requests
-            actual_id = song_id.split(":")[1]
-            url = f"https://c.y.qq.com/lyric/fcgi-bin/fcg_query_lyric_new.fcg?songmid={actual_id}&format=json&nobase64=1"
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36",
-                "Referer": "https://y.qq.com/"
-            }
-            resp = requests.get(url, headers=headers, timeout=5)
-            if resp.ok:
-                data = resp.json()
-                lrc_text = data.get("lyric", "")
-                
-                if lrc_text:
-                    # Cache the lyrics
-                    if not cached_metadata:
-                        cached_metadata = {"id": song_id, "artist": artist, "title": title}
-                    cached_metadata["lyrics"] = lrc_text
-                    set_cached(song_metadata_cache, song_id, cached_metadata)
-                    logger.info(f"[LYRICS] Fetched and cached QQ lyrics for {song_id}")
-        except Exception as e:
-            logger.warning(f"[LYRICS] Failed to fetch QQ lyrics: {e}")
+    # XML is written out in chunks as it is generated, JSON goes through the element tree
+    if get_response_format() != "json":
+        return Response(iter_structured_lyrics_xml(display_artist, title, synced, lines), content_type=XML_CONTENT_TYPE)
     
     # Build OpenSubsonic structured lyrics response
     root = create_subsonic_response("ok")
@@ -835,68 +1612,110 @@ def get_lyrics_by_song_id():
     
     lyrics_list = SubElement(root, "lyricsList")
     
-    if lrc_text:
-        parsed_lines = parse_lrc_to_lines(lrc_text)
-        
-        if parsed_lines:
-            # Synced lyrics (with timestamps)
-            structured = SubElement(lyrics_list, "structuredLyrics")
-            structured.set("displayArtist", strip_platform_prefix(artist))
-            structured.set("displayTitle", title)
-            structured.set("lang", "zh")  # Assume Chinese for now
-            structured.set("synced", "true")
-            structured.set("offset", "0")
-            
-            for line_data in parsed_lines:
-                line_elem = SubElement(structured, "line")
-                line_elem.set("start", str(line_data["start"]))
-                line_elem.text = line_data["value"]
-            
-            logger.info(f"[LYRICS] Returning {len(parsed_lines)} synced lines for {song_id}")
+    if lines:
+        structured = SubElement(lyrics_list, "structuredLyrics", {
+            "displayArtist": display_artist,
+            "displayTitle": title,
+            "lang": "zh",  # Assume Chinese for now
+            "synced": "true" if synced else "false",
+            "offset": "0",
+        })
+        
+        # Attributes passed at construction: one C call per line instead of three
+        if synced:
+            for start, text in lines:
+                SubElement(structured, "line", {"start": str(start)}).text = text
         else:
-            # Check if it's unsynced lyrics (no timestamps)
-            plain_lines = [l.strip() for l in lrc_text.split('\n') if l.strip() and not l.startswith('[')]
-            if plain_lines:
-                structured = SubElement(lyrics_list, "structuredLyrics")
-                structured.set("displayArtist", strip_platform_prefix(artist))
-                structured.set("displayTitle", title)
-                structured.set("lang", "zh")
-                structured.set("synced", "false")
-                structured.set("offset", "0")
-                
-                for text in plain_lines:
-                    line_elem = SubElement(structured, "line")
-                    line_elem.text = text
-                
-                logger.info(f"[LYRICS] Returning {len(plain_lines)} unsynced lines for {song_id}")
-    else:
-        logger.info(f"[LYRICS] No lyrics found for {song_id}")
+            for text in lines:
+                SubElement(structured, "line").text = text
     
     return make_response_from_element(root)
 
 
 # ============ Browsing Endpoints ============
 
-@app.route("/rest/getMusicFolders", methods=["GET"])
-@app.route("/rest/getMusicFolders.view", methods=["GET"])
+@subsonic_route("getMusicFolders")
 @require_auth
 def get_music_folders():
     """Get music folders (platforms)"""
-    return make_response_from_element(format_music_folders())
+    return make_prerendered_response(MUSIC_FOLDERS_RESPONSE)
 
 
-@app.route("/rest/getIndexes", methods=["GET"])
-@app.route("/rest/getIndexes.view", methods=["GET"])
+@subsonic_route("getIndexes")
 @require_auth
 def get_indexes():
     """Get indexes (empty, we use playlists instead)"""
-    return make_response_from_element(format_indexes())
+    return make_prerendered_response(INDEXES_RESPONSE)
 
 
 # ============ Playlist Endpoints ============
 
-@app.route("/rest/getPlaylists", methods=["GET"])
-@app.route("/rest/getPlaylists.view", methods=["GET"])
+# Platforms with a non-empty whitelist, resolved once (only netease and qq; kuwo excluded per user)
+_EMPTY_WHITELIST = frozenset()
+FETCHABLE_PLAYLIST_PLATFORMS = [p for p in ("netease", "qq") if ALLOWED_PLAYLISTS.get(p)]
+
+def fetch_toplists_safe(platform: str) -> list:
+    """Get toplists for one platform, logging and returning [] on failure"""
+    try:
+        return tunehub_client.get_toplists(platform)
+    except Exception as e:
+        logger.warning(f"Failed to get toplists from {platform}: {e}")
+        return []
+
+
+def load_filtered_toplists(platform: str, cache_key: str) -> list:
+    """Fetch toplists from TuneHub, apply the ALLOWED_PLAYLISTS whitelist and cache the result"""
+    logger.info(f"[API CALL] Fetching toplists from {platform}")
+    all_toplists = []
+    
+    # Only fetch platforms that have allowed playlists
+    if platform == "all":
+        platforms_to_fetch = FETCHABLE_PLAYLIST_PLATFORMS
+    else:
+        platforms_to_fetch = [platform]
+    
+    # Fetch platforms concurrently (network-bound); results keep platform order
+    if len(platforms_to_fetch) > 1:
+        for toplists in upstream_pool.map(fetch_toplists_safe, platforms_to_fetch):
+            all_toplists.extend(toplists)
+    else:
+        for p in platforms_to_fetch:
+            all_toplists.extend(fetch_toplists_safe(p))
+    
+    # Apply whitelist filter. Trace logging is decided once: its arguments (the sorted
+    # whitelist sample in particular) would otherwise be built for every toplist.
+    filtered_toplists = []
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("ALLOWED_PLAYLISTS = %s", ALLOWED_PLAYLISTS)
+    for toplist in all_toplists:
+        platform_id = toplist.get("platform", "")
+        toplist_id = str(toplist.get("id", ""))
+        allowed_ids = ALLOWED_PLAYLISTS.get(platform_id, _EMPTY_WHITELIST)
+        
+        # If whitelist is empty, skip that platform. If has items, filter by ID.
+        passed = toplist_id in allowed_ids
+        if passed:
+            filtered_toplists.append(toplist)
+        
+        if debug:
+            toplist_name = toplist.get("name", "Unknown")
+            logger.debug("Checking: platform=%s, id=%s, name=%s", platform_id, toplist_id, toplist_name)
+            logger.debug("Allowed IDs for %s: %s", platform_id, allowed_ids)
+            if passed:
+                logger.debug("✓ PASSED: %s", toplist_name)
+            else:
+                logger.debug("✗ REJECTED: %s (id=%s not in %s...)", toplist_name, toplist_id, sorted(allowed_ids)[:3])
+    
+    logger.info(f"[FILTER] Filtered {len(all_toplists)} -> {len(filtered_toplists)} playlists")
+    
+    # Cache the filtered result
+    set_cached(playlist_cache, cache_key, filtered_toplists)
+    logger.info(f"[CACHED] Stored {len(filtered_toplists)} playlists for {platform}")
+    return filtered_toplists
+
+
+@subsonic_route("getPlaylists")
 @require_auth
 def get_playlists():
     """Get all playlists (mapped from TuneHub toplists) - cached for 6 hours, filtered by whitelist"""
@@ -904,66 +1723,14 @@ def get_playlists():
         # Default to 'all' to show playlists from all platforms
         platform = request.args.get("platform", "all")
         
-        # Check cache first
+        # Check cache first; on a miss, concurrent requests share one upstream fetch
         cache_key = f"playlists_filtered_{platform}"
-        cached_data = get_cached(playlist_cache, cache_key)
-        if cached_data:
-            logger.info(f"[CACHE HIT] Returning cached playlists for {platform}")
-            # Always add user playlists at the beginning
-            all_playlists = []
-            for pl_id, pl_data in user_playlists.items():
-                all_playlists.append({
-                    "id": pl_id,
-                    "name": pl_data['name'],
-                    "platform": "user",
-                    "songCount": len(pl_data.get("songs", []))
-                })
-            all_playlists.extend(cached_data)
-            return make_response_from_element(format_playlists(all_playlists))
-        
-        logger.info(f"[API CALL] Fetching toplists from {platform}")
-        all_toplists = []
-        
-        # Only fetch platforms that have allowed playlists
-        platforms_to_fetch = []
-        if platform == "all":
-            for p in ["netease", "qq"]:  # Only netease and qq (kuwo excluded per user)
-                if ALLOWED_PLAYLISTS.get(p):
-                    platforms_to_fetch.append(p)
+        filtered_toplists = get_cached(playlist_cache, cache_key)
+        if filtered_toplists:
+            logger.info("[CACHE HIT] Returning cached playlists for %s", platform)
         else:
-            platforms_to_fetch = [platform]
-        
-        for p in platforms_to_fetch:
-            try:
-                toplists = tunehub_client.get_toplists(p)
-                all_toplists.extend(toplists)
-            except Exception as e:
-                logger.warning(f"Failed to get toplists from {p}: {e}")
-        
-        # Apply whitelist filter
-        filtered_toplists = []
-        logger.info(f"[DEBUG] ALLOWED_PLAYLISTS = {ALLOWED_PLAYLISTS}")
-        for toplist in all_toplists:
-            platform_id = toplist.get("platform", "")
-            toplist_id = str(toplist.get("id", ""))
-            toplist_name = toplist.get("name", "Unknown")
-            allowed_ids = ALLOWED_PLAYLISTS.get(platform_id, [])
-            
-            logger.info(f"[DEBUG] Checking: platform={platform_id}, id={toplist_id}, name={toplist_name}")
-            logger.info(f"[DEBUG] Allowed IDs for {platform_id}: {allowed_ids}")
-            
-            # If whitelist is empty, skip that platform. If has items, filter by ID.
-            if allowed_ids and toplist_id in allowed_ids:
-                logger.info(f"[DEBUG] ✓ PASSED: {toplist_name}")
-                filtered_toplists.append(toplist)
-            else:
-                logger.info(f"[DEBUG] ✗ REJECTED: {toplist_name} (id={toplist_id} not in {allowed_ids[:3]}...)")
-        
-        logger.info(f"[FILTER] Filtered {len(all_toplists)} -> {len(filtered_toplists)} playlists")
-        
-        # Cache the filtered result
-        set_cached(playlist_cache, cache_key, filtered_toplists)
-        logger.info(f"[CACHED] Stored {len(filtered_toplists)} playlists for {platform}")
+            filtered_toplists = load_once(cache_key, playlist_cache,
+                                          lambda: load_filtered_toplists(platform, cache_key))
         
         # Add user playlists at the beginning
         all_playlists = []
@@ -983,8 +1750,42 @@ def get_playlists():
         return make_response_from_element(format_error(0, str(e)))
 
 
-@app.route("/rest/getPlaylist", methods=["GET"])
-@app.route("/rest/getPlaylist.view", methods=["GET"])
+def load_playlist_detail(playlist_id: str, cache_key: str) -> dict:
+    """Fetch a toplist's songs from TuneHub, seed song metadata and cache the playlist"""
+    # Parse platform and actual ID from composite ID (format: platform_id)
+    platform, sep, actual_id = playlist_id.partition("_")
+    if not sep:
+        platform, actual_id = DEFAULT_PLATFORM, playlist_id
+    
+    logger.info(f"[API CALL] Fetching playlist detail: {playlist_id}")
+    
+    # Get playlist detail from TuneHub
+    result = tunehub_client.get_toplist_detail(platform, actual_id)
+    
+    playlist_name = result.get("name", "Unknown Playlist")
+    songs = result.get("songs", [])
+    cover_url = result.get("coverUrl", "")
+    
+    # Cache metadata for each song (so cover art works immediately), in one batched update.
+    # Don't overwrite existing cache entries that have lyrics/more info.
+    set_cached_bulk(song_metadata_cache, {
+        song["id"]: song for song in songs
+        if song.get("id") and not (get_cached(song_metadata_cache, song["id"]) or {}).get("lyrics")
+    })
+    
+    # Cache raw data (JSON serializable) - NOT Element!
+    cache_data = {
+        "id": playlist_id,
+        "name": playlist_name,
+        "songs": songs,
+        "coverUrl": cover_url
+    }
+    set_cached(playlist_cache, cache_key, cache_data)
+    logger.info(f"[CACHED] Stored playlist {playlist_id} with {len(songs)} songs")
+    return cache_data
+
+
+@subsonic_route("getPlaylist")
 @require_auth
 def get_playlist():
     """Get a specific playlist (toplist) with songs - cached for 6 hours"""
@@ -1011,57 +1812,22 @@ def get_playlist():
                 ""
             ))
         
-        # Check cache first
+        # Check cache first; on a miss, concurrent requests share one upstream fetch
         cache_key = f"playlist_detail_{playlist_id}"
         cached_data = get_cached(playlist_cache, cache_key)
         if cached_data:
-            logger.info(f"[CACHE HIT] Returning cached playlist: {playlist_id}")
-            # Regenerate Element from cached dict data
-            return make_response_from_element(format_playlist(
-                cached_data.get("id", playlist_id),
-                cached_data.get("name", "Unknown"),
-                cached_data.get("songs", []),
-                cached_data.get("coverUrl", "")
-            ))
-        
-        # Parse platform and actual ID from composite ID (format: platform_id)
-        if "_" in playlist_id:
-            platform, actual_id = playlist_id.split("_", 1)
+            logger.info("[CACHE HIT] Returning cached playlist: %s", playlist_id)
         else:
-            platform = DEFAULT_PLATFORM
-            actual_id = playlist_id
-        
-        logger.info(f"[API CALL] Fetching playlist detail: {playlist_id}")
+            cached_data = load_once(cache_key, playlist_cache,
+                                    lambda: load_playlist_detail(playlist_id, cache_key))
         
-        # Get playlist detail from TuneHub
-        result = tunehub_client.get_toplist_detail(platform, actual_id)
-        
-        playlist_name = result.get("name", "Unknown Playlist")
-        songs = result.get("songs", [])
-        cover_url = result.get("coverUrl", "")
-        
-        # Cache metadata for each song (so cover art works immediately)
-        for song in songs:
-            song_id = song.get("id")
-            if song_id:
-                # Don't overwrite existing cache if it has lyrics/more info
-                existing = get_cached(song_metadata_cache, song_id)
-                if not existing or not existing.get("lyrics"):
-                    # Store basic info from playlist
-                    set_cached(song_metadata_cache, song_id, song)
-        
-        # Cache raw data (JSON serializable) - NOT Element!
-        cache_data = {
-            "id": playlist_id,
-            "name": playlist_name,
-            "songs": songs,
-            "coverUrl": cover_url
-        }
-        set_cached(playlist_cache, cache_key, cache_data)
-        logger.info(f"[CACHED] Stored playlist {playlist_id} with {len(songs)} songs")
-        
-        # Generate and return Element
-        return make_response_from_element(format_playlist(playlist_id, playlist_name, songs, cover_url))
+        # Regenerate Element from cached dict data
+        return make_response_from_element(format_playlist(
+            cached_data.get("id", playlist_id),
+            cached_data.get("name", "Unknown"),
+            cached_data.get("songs", []),
+            cached_data.get("coverUrl", "")
+        ))
     
     except Exception as e:
         logger.error(f"Error getting playlist: {e}")
@@ -1070,14 +1836,55 @@ def get_playlist():
 
 # ============ Search Endpoints ============
 
-@app.route("/rest/search2", methods=["GET"])
-@app.route("/rest/search2.view", methods=["GET"])
-@app.route("/rest/search3", methods=["GET"])
-@app.route("/rest/search3.view", methods=["GET"])
+def add_fallback_artists(search_result, all_songs: list, artist_count: int):
+    """Add up to artist_count artists taken from the song results (when artist search has nothing)"""
+    seen_artists = set()
+    for song in all_songs[:artist_count * 3]:
+        artist_name = song.get("artist", "")
+        if artist_name and artist_name not in seen_artists:
+            seen_artists.add(artist_name)
+            if len(seen_artists) > artist_count:
+                break
+            
+            song_id = song.get("id", "")
+            platform, sep, _ = song_id.partition(":")
+            display_name = artist_name
+            if sep and platform in PLATFORM_DISPLAY_NAMES:
+                display_name = f"{PLATFORM_DISPLAY_NAMES[platform]} - {artist_name}"
+            SubElement(search_result, "artist", {
+                "id": f"ar-{song_id}",
+                "name": display_name,
+                "coverArt": f"ar-{song_id}",
+                "albumCount": "1",
+            })
+
+def add_fallback_albums(search_result, all_songs: list, album_count: int):
+    """Add one album per song result, up to album_count (when album search has nothing)"""
+    for song in all_songs[:album_count]:
+        song_id = song.get("id", "")
+        platform, sep, _ = song_id.partition(":")
+        album_name = song.get("album") or song.get("title", "Unknown")
+        if sep and platform in PLATFORM_DISPLAY_NAMES:
+            album_name = f"{PLATFORM_DISPLAY_NAMES[platform]} - {album_name}"
+        SubElement(search_result, "album", {
+            "id": song_id,
+            "name": album_name,
+            "artist": song.get("artist", "Unknown"),
+            "artistId": f"ar-{song_id}",
+            "coverArt": f"al-{song_id}",
+            "songCount": "1",
+            "duration": str(song.get("duration", 0)),
+            "created": "2024-01-01T00:00:00.000Z",
+        })
+
+
+# Platforms queried when SEARCH_PLATFORMS=both, in result order (QQ first)
+BOTH_SEARCH_PLATFORMS = ("qq", "netease")
+
+@subsonic_route("search2", "search3")
 @require_auth
 def search():
     """Search for songs across multiple platforms - handles artist/album/song counts"""
-    from xml.etree.ElementTree import SubElement
     try:
         query = request.args.get("query", "")
         
@@ -1103,14 +1910,12 @@ def search():
                 # Single platform search (from URL parameter)
                 songs = tunehub_client.search(platform, query)
                 all_songs.extend(songs)
-            elif SEARCH_PLATFORMS in ("qq", "netease"):
+            elif SEARCH_MODE != SearchMode.BOTH:
                 # Single platform from config
                 songs = tunehub_client.search(SEARCH_PLATFORMS, query)
                 all_songs.extend(songs)
             else:
                 # Multi-platform search: search both, QQ results first
-                from concurrent.futures import ThreadPoolExecutor, as_completed
-                
                 def search_platform(p):
                     try:
                         return tunehub_client.search(p, query)
@@ -1118,42 +1923,23 @@ def search():
                         logger.warning(f"Search failed for {p}: {e}")
                         return []
                 
-                # Search both platforms in parallel, collect results separately
-                qq_songs = []
-                netease_songs = []
-                with ThreadPoolExecutor(max_workers=2) as executor:
-                    futures = {executor.submit(search_platform, p): p for p in ["qq", "netease"]}
-                    for future in as_completed(futures):
-                        platform_name = futures[future]
-                        songs = future.result()
-                        if platform_name == "qq":
-                            qq_songs = songs
-                        else:
-                            netease_songs = songs
-                
-                # QQ results first, then Netease
-                all_songs.extend(qq_songs)
-                all_songs.extend(netease_songs)
+                # Search all platforms in parallel; map() yields in submission order,
+                # so QQ results come first, then Netease
+                for songs in upstream_pool.map(search_platform, BOTH_SEARCH_PLATFORMS):
+                    all_songs.extend(songs)
         
         # Cache song metadata for cover art support
-        for song in all_songs:
-            song_id = song.get("id", "")
-            if song_id and song.get("coverUrl"):
-                set_cached(song_metadata_cache, song_id, song)
-        
-        # Platform name mapping
-        platform_names = {
-            "netease": "网易云",
-            "qq": "QQ",
-            "kuwo": "酷我"
-        }
+        set_cached_bulk(song_metadata_cache, {
+            song["id"]: song for song in all_songs
+            if song.get("id") and song.get("coverUrl")
+        })
         
         # Build response
         root = create_subsonic_response("ok")
         search_result = SubElement(root, result_elem_name)
         
         # Determine which platform to use for artist/album search based on SEARCH_PLATFORMS
-        search_platform = "qq" if SEARCH_PLATFORMS != "netease" else "netease"
+        search_platform = "netease" if SEARCH_MODE == SearchMode.NETEASE else "qq"
         
         # Add artists using real artist search API (only for QQ for now)
         if artist_count > 0:
@@ -1164,57 +1950,20 @@ def search():
                     artists = tunehub_client.search_artists("qq", query, page_size=artist_count)
                 
                 for artist in artists:
-                    artist_elem = SubElement(search_result, "artist")
                     artist_id = artist.get("id", "")
-                    artist_elem.set("id", f"ar-{artist_id}")
-                    display_name = f"QQ - {artist.get('name', 'Unknown')}"
-                    artist_elem.set("name", display_name)
-                    artist_elem.set("coverArt", f"ar-{artist_id}")
-                    artist_elem.set("albumCount", str(artist.get("albumCount", 0)))
+                    SubElement(search_result, "artist", {
+                        "id": f"ar-{artist_id}",
+                        "name": f"QQ - {artist.get('name', 'Unknown')}",
+                        "coverArt": f"ar-{artist_id}",
+                        "albumCount": str(artist.get("albumCount", 0)),
+                    })
                 
                 # If no results from QQ Music, fallback to extracting from songs
-                if not artists and all_songs:
-                    seen_artists = set()
-                    for song in all_songs[:artist_count * 3]:
-                        artist_name = song.get("artist", "")
-                        if artist_name and artist_name not in seen_artists:
-                            seen_artists.add(artist_name)
-                            if len(seen_artists) > artist_count:
-                                break
-                            
-                            song_id = song.get("id", "")
-                            platform = song_id.split(":")[0] if ":" in song_id else ""
-                            
-                            artist_elem = SubElement(search_result, "artist")
-                            artist_elem.set("id", f"ar-{song_id}")
-                            display_name = artist_name
-                            if platform in platform_names:
-                                display_name = f"{platform_names[platform]} - {artist_name}"
-                            artist_elem.set("name", display_name)
-                            artist_elem.set("coverArt", f"ar-{song_id}")
-                            artist_elem.set("albumCount", "1")
+                if not artists:
+                    add_fallback_artists(search_result, all_songs, artist_count)
             except Exception as e:
                 logger.warning(f"Artist search failed, using fallback: {e}")
-                # Fallback to old behavior
-                seen_artists = set()
-                for song in all_songs[:artist_count * 3]:
-                    artist_name = song.get("artist", "")
-                    if artist_name and artist_name not in seen_artists:
-                        seen_artists.add(artist_name)
-                        if len(seen_artists) > artist_count:
-                            break
-                        
-                        song_id = song.get("id", "")
-                        platform = song_id.split(":")[0] if ":" in song_id else ""
-                        
-                        artist_elem = SubElement(search_result, "artist")
-                        artist_elem.set("id", f"ar-{song_id}")
-                        display_name = artist_name
-                        if platform in platform_names:
-                            display_name = f"{platform_names[platform]} - {artist_name}"
-                        artist_elem.set("name", display_name)
-                        artist_elem.set("coverArt", f"ar-{song_id}")
-                        artist_elem.set("albumCount", "1")
+                add_fallback_artists(search_result, all_songs, artist_count)
         
         # Add albums using real album search API (only for QQ for now)
         if album_count > 0:
@@ -1224,71 +1973,35 @@ def search():
                     albums = tunehub_client.search_albums("qq", query, page_size=album_count)
                 
                 for album in albums:
-                    album_elem = SubElement(search_result, "album")
                     album_id = album.get("id", "")
-                    album_elem.set("id", f"al-{album_id}")
-                    album_name = f"QQ - {album.get('name', 'Unknown')}"
-                    album_elem.set("name", album_name)
-                    album_elem.set("artist", album.get("artist", "Unknown"))
-                    album_elem.set("artistId", "")
-                    album_elem.set("coverArt", f"al-{album_id}")
-                    album_elem.set("songCount", str(album.get("songCount", 0)))
-                    album_elem.set("duration", "0")
-                    album_elem.set("created", "2024-01-01T00:00:00.000Z")
+                    SubElement(search_result, "album", {
+                        "id": f"al-{album_id}",
+                        "name": f"QQ - {album.get('name', 'Unknown')}",
+                        "artist": album.get("artist", "Unknown"),
+                        "artistId": "",
+                        "coverArt": f"al-{album_id}",
+                        "songCount": str(album.get("songCount", 0)),
+                        "duration": "0",
+                        "created": "2024-01-01T00:00:00.000Z",
+                    })
                 
                 # If no results from QQ Music, fallback to extracting from songs
-                if not albums and all_songs:
-                    for song in all_songs[:album_count]:
-                        song_id = song.get("id", "")
-                        platform = song_id.split(":")[0] if ":" in song_id else ""
-                        
-                        album_elem = SubElement(search_result, "album")
-                        album_elem.set("id", song_id)
-                        album_name = song.get("album") or song.get("title", "Unknown")
-                        if platform in platform_names:
-                            album_name = f"{platform_names[platform]} - {album_name}"
-                        album_elem.set("name", album_name)
-                        album_elem.set("artist", song.get("artist", "Unknown"))
-                        album_elem.set("artistId", f"ar-{song_id}")
-                        album_elem.set("coverArt", f"al-{song_id}")
-                        album_elem.set("songCount", "1")
-                        album_elem.set("duration", str(song.get("duration", 0)))
-                        album_elem.set("created", "2024-01-01T00:00:00.000Z")
+                if not albums:
+                    add_fallback_albums(search_result, all_songs, album_count)
             except Exception as e:
                 logger.warning(f"Album search failed, using fallback: {e}")
-                # Fallback to old behavior
-                for song in all_songs[:album_count]:
-                    song_id = song.get("id", "")
-                    platform = song_id.split(":")[0] if ":" in song_id else ""
-                    
-                    album_elem = SubElement(search_result, "album")
-                    album_elem.set("id", song_id)
-                    album_name = song.get("album") or song.get("title", "Unknown")
-                    if platform in platform_names:
-                        album_name = f"{platform_names[platform]} - {album_name}"
-                    album_elem.set("name", album_name)
-                    album_elem.set("artist", song.get("artist", "Unknown"))
-                    album_elem.set("artistId", f"ar-{song_id}")
-                    album_elem.set("coverArt", f"al-{song_id}")
-                    album_elem.set("songCount", "1")
-                    album_elem.set("duration", str(song.get("duration", 0)))
-                    album_elem.set("created", "2024-01-01T00:00:00.000Z")
+                add_fallback_albums(search_result, all_songs, album_count)
         
         # Add songs
         if song_count > 0:
             for song in all_songs[:song_count]:
                 song_elem = SubElement(search_result, "song")
+                _set_song_attributes(song_elem, song)
                 
-                song_id = song.get("id", "")
-                platform = song_id.split(":")[0] if ":" in song_id else ""
-                
-                # Add platform prefix to artist name
-                display_song = song.copy()
-                original_artist = song.get("artist", "Unknown")
-                if platform in platform_names:
-                    display_song["artist"] = f"{platform_names[platform]} - {original_artist}"
-                
-                _set_song_attributes(song_elem, display_song)
+                # Add platform prefix to artist name (set() keeps the attribute's position)
+                platform, sep, _ = song.get("id", "").partition(":")
+                if sep and platform in PLATFORM_DISPLAY_NAMES:
+                    song_elem.set("artist", f"{PLATFORM_DISPLAY_NAMES[platform]} - {song.get('artist', 'Unknown')}")
         
         return make_response_from_element(root)
     
@@ -1299,10 +2012,7 @@ def search():
 
 # ============ Media Endpoints ============
 
-@app.route("/rest/stream", methods=["GET"])
-@app.route("/rest/stream.view", methods=["GET"])
-@app.route("/rest/download", methods=["GET"])
-@app.route("/rest/download.view", methods=["GET"])
+@subsonic_route("stream", "download")
 @require_auth
 def stream():
     """Stream a song - redirects to actual music URL (cached for 6 hours)"""
@@ -1313,11 +2023,9 @@ def stream():
             return make_response_from_element(format_error(10, "Required parameter is missing: id"))
         
         # Parse platform and actual ID (format: platform:songId)
-        if ":" in song_id:
-            platform, actual_id = song_id.split(":", 1)
-        else:
-            platform = DEFAULT_PLATFORM
-            actual_id = song_id
+        platform, sep, actual_id = song_id.partition(":")
+        if not sep:
+            platform, actual_id = DEFAULT_PLATFORM, song_id
         
         # Get requested quality (bitrate in kbps)
         max_bit_rate = request.args.get("maxBitRate", "")
@@ -1344,54 +2052,41 @@ def stream():
         # First try with metadata (new friendly format)
         if cached_metadata and is_audio_cached(song_id, quality, cached_metadata):
             audio_path = get_audio_cache_path(song_id, quality, cached_metadata)
-            logger.info(f"[LOCAL CACHE HIT] Serving audio from disk: {song_id}")
-            return send_file(audio_path, mimetype='audio/mpeg')
+            logger.info("[LOCAL CACHE HIT] Serving audio from disk: %s", song_id)
+            return send_cached_audio(audio_path)
         # Also check legacy format (without metadata) for backward compatibility
         elif is_audio_cached(song_id, quality, None):
             audio_path = get_audio_cache_path(song_id, quality, None)
-            logger.info(f"[LOCAL CACHE HIT] Serving audio from disk (legacy): {song_id}")
-            return send_file(audio_path, mimetype='audio/mpeg')
+            logger.info("[LOCAL CACHE HIT] Serving audio from disk (legacy): %s", song_id)
+            return send_cached_audio(audio_path)
         
         # Check URL cache second - still saves API call within 30 min window
         cache_key = f"stream_{song_id}_{quality}"
         cached_url = get_cached(stream_url_cache, cache_key, ttl=1800)
         if cached_url:
-            logger.info(f"[URL CACHE HIT] Returning cached stream URL for {song_id}")
+            logger.info("[URL CACHE HIT] Returning cached stream URL for %s", song_id)
             return redirect(cached_url, code=302)
         
-        # Check if request is already pending (prevent race condition)
-        with cache_lock:
-            is_pending = cache_key in pending_requests
-            if not is_pending:
-                pending_requests.add(cache_key)
-        
-        if is_pending:
+        # Claim this key, or wait on the Event of the request already parsing it
+        # (dict.setdefault is atomic, so no lock is needed here)
+        pending_event = threading.Event()
+        other_event = pending_requests.setdefault(cache_key, pending_event)
+        if other_event is not pending_event:
             logger.info(f"[PENDING] Request already in progress for {song_id}, waiting...")
-            # Wait for the other request to finish (with retries, max 35s which is longer than API timeout of 30s)
-            import time as time_module
-            max_wait = 35  # seconds
-            wait_interval = 0.5  # seconds
-            waited = 0
-            while waited < max_wait:
-                time_module.sleep(wait_interval)
-                waited += wait_interval
+            # Max 35s, which is longer than the API timeout of 30s
+            max_wait = 35
+            wait_start = time.monotonic()
+            if other_event.wait(timeout=max_wait):
                 cached_url = get_cached(stream_url_cache, cache_key, ttl=1800)
                 if cached_url:
-                    logger.info(f"[PENDING RESOLVED] Found cached URL for {song_id} after {waited:.1f}s")
+                    logger.info(f"[PENDING RESOLVED] Found cached URL for {song_id} after {time.monotonic() - wait_start:.1f}s")
                     return redirect(cached_url, code=302)
-                # Check if still pending
-                with cache_lock:
-                    if cache_key not in pending_requests:
-                        # The other request finished but didn't cache (maybe failed)
-                        # We should try again
-                        pending_requests.add(cache_key)
-                        logger.info(f"[PENDING EXPIRED] Other request finished without caching for {song_id}, taking over...")
-                        break
+                # The other request finished but didn't cache (maybe failed)
+                logger.info(f"[PENDING EXPIRED] Other request finished without caching for {song_id}, taking over...")
             else:
                 # Timeout - the other request might have failed, try ourselves
                 logger.warning(f"[PENDING TIMEOUT] Waited {max_wait}s for {song_id}, proceeding with own API call...")
-                with cache_lock:
-                    pending_requests.add(cache_key)
+            pending_requests[cache_key] = pending_event
         
         try:
             # Parse song to get real URL (consumes 1 credit)
@@ -1423,7 +2118,11 @@ def stream():
                 
             set_cached(song_metadata_cache, song_id, metadata)
             logger.info(f"[CACHED] Stored stream URL and metadata for {song_id}")
-            save_cache() # Persist immediately
+            request_cache_save()  # Persisted by the background writer
+            
+            # Parse returned no lyrics: fetch them from the free API while the audio starts
+            if not metadata["lyrics"] and platform in ("netease", "qq"):
+                upstream_pool.submit(prefetch_lyrics, song_id)
             
             # Log credit usage
             log_credit_usage(
@@ -1435,57 +2134,29 @@ def stream():
                 quality=quality
             )
             
-            # Start background download to local cache for future plays
-            def download_audio_background(url, song_id, quality, song_metadata):
-                import requests as req  # Import inside thread
-                try:
-                    audio_path = get_audio_cache_path(song_id, quality, song_metadata)
-                    logger.info(f"[DOWNLOAD] Starting background download: {song_id} -> {os.path.basename(audio_path)}")
-                    
-                    # Download the audio file
-                    audio_response = req.get(url, timeout=120, stream=True)
-                    if audio_response.ok:
-                        # Save to temporary file first, then rename
-                        temp_path = audio_path + ".tmp"
-                        with open(temp_path, 'wb') as f:
-                            for chunk in audio_response.iter_content(chunk_size=8192):
-                                if chunk:
-                                    f.write(chunk)
-                        
-                        # Rename to final path
-                        os.rename(temp_path, audio_path)
-                        logger.info(f"[DOWNLOAD] Completed: {song_id} ({os.path.getsize(audio_path) / 1024 / 1024:.1f} MB)")
-                        
-                        # Clean up cache if exceeds max size
-                        cleanup_audio_cache()
-                    else:
-                        logger.warning(f"[DOWNLOAD] Failed to download {song_id}: HTTP {audio_response.status_code}")
-                except Exception as e:
-                    logger.error(f"[DOWNLOAD] Error downloading {song_id}: {e}")
+            # No Range header: proxy the audio and fill the local cache from the same fetch
+            if "Range" not in request.headers:
+                tee_response = stream_and_cache_audio(stream_url, song_id, quality, metadata)
+                if tee_response is not None:
+                    return tee_response
             
-            # Start download in background thread
-            import threading
-            download_thread = threading.Thread(
-                target=download_audio_background, 
-                args=(stream_url, song_id, quality, metadata),
-                daemon=True
-            )
-            download_thread.start()
+            # Queue background download to local cache for future plays
+            submit_audio_download(stream_url, song_id, quality, metadata)
             
-            # 302 redirect to actual music URL (user streams from source while we download)
+            # 302 redirect to actual music URL (client seeks/streams from source while we download)
             return redirect(stream_url, code=302)
         finally:
-            # Remove from pending requests
-            with cache_lock:
-                pending_requests.discard(cache_key)
+            # Remove from pending requests (unless a timed-out waiter took over) and wake waiters
+            if pending_requests.get(cache_key) is pending_event:
+                pending_requests.pop(cache_key, None)
+            pending_event.set()
     
     except Exception as e:
         logger.error(f"Error streaming: {e}")
         return make_response_from_element(format_error(0, str(e)))
 
 
-@app.route("/rest/getSong", methods=["GET"])
-@app.route("/rest/getSong.view", methods=["GET"])
+@subsonic_route("getSong")
 @require_auth
 def get_song():
     """Get song details - uses cached metadata from parse"""
@@ -1498,7 +2169,7 @@ def get_song():
         # Check if we have cached metadata from a previous parse
         cached_metadata = get_cached(song_metadata_cache, song_id)
         if cached_metadata:
-            logger.info(f"[CACHE HIT] Returning cached metadata for {song_id}")
+            logger.info("[CACHE HIT] Returning cached metadata for %s", song_id)
             return make_response_from_element(format_song(cached_metadata))
         
         # No cached metadata, return basic info
@@ -1518,12 +2189,10 @@ def get_song():
         return make_response_from_element(format_error(0, str(e)))
 
 
-@app.route("/rest/getAlbum", methods=["GET"])
-@app.route("/rest/getAlbum.view", methods=["GET"])
+@subsonic_route("getAlbum")
 @require_auth
 def get_album():
     """Get album details - fetches from QQ Music API if possible, otherwise falls back to song metadata"""
-    from xml.etree.ElementTree import SubElement
     try:
         album_id = request.args.get("id", "")
         
@@ -1539,11 +2208,9 @@ def get_album():
             album_ref = album_id[3:]  # Remove "al-" prefix
         
         # Parse platform and mid
-        if ":" in album_ref:
-            platform, actual_mid = album_ref.split(":", 1)
-        else:
-            platform = "qq"
-            actual_mid = album_ref
+        platform, sep, actual_mid = album_ref.partition(":")
+        if not sep:
+            platform, actual_mid = "qq", album_ref
         
         # Only try to fetch real album data if album_id starts with "al-" (from album search)
         # This avoids unnecessary API calls for song IDs from playlists
@@ -1559,10 +2226,7 @@ def get_album():
                 songs = result.get("songs", [])
                 
                 # Cache song metadata
-                for song in songs:
-                    song_id = song.get("id", "")
-                    if song_id:
-                        set_cached(song_metadata_cache, song_id, song)
+                set_cached_bulk(song_metadata_cache, {song["id"]: song for song in songs if song.get("id")})
                 
                 if album_info and songs:
                     logger.info(f"[ALBUM] Found {len(songs)} songs in album {album_info.get('name', 'Unknown')}")
@@ -1619,7 +2283,7 @@ def get_album():
         # Check if we have cached metadata
         cached_metadata = get_cached(song_metadata_cache, song_id)
         if cached_metadata:
-            logger.info(f"[CACHE HIT] Returning cached album for {song_id}")
+            logger.info("[CACHE HIT] Returning cached album for %s", song_id)
         else:
             # Return basic placeholder
             cached_metadata = {
@@ -1677,94 +2341,76 @@ def get_album():
         return make_response_from_element(format_error(0, str(e)))
 
 
-@app.route("/rest/getCoverArt", methods=["GET"])
-@app.route("/rest/getCoverArt.view", methods=["GET"])
+# Fallback cover URLs when nothing is cached ({} = platform id)
+DEFAULT_COVER_URL = "https://y.qq.com/mediastyle/global/img/album_300.png"
+SONG_COVER_TEMPLATES = {"netease": "https://p1.music.126.net/song_cover_{}.jpg"}
+PLAYLIST_COVER_TEMPLATES = {"netease": "https://p1.music.126.net/playlist_cover_{}.jpg"}
+
+def resolve_cover_url(cover_id: str) -> str:
+    """Map a coverArt id to an upstream image URL, or "" if it can't be resolved"""
+    # Playlist cover (format: pl-platform_id)
+    if cover_id.startswith("pl-"):
+        playlist_id = cover_id[3:]
+        if "_" not in playlist_id:
+            return ""
+        cached_data = get_cached(playlist_cache, f"playlist_detail_{playlist_id}")
+        if cached_data and cached_data.get("coverUrl"):
+            return cached_data["coverUrl"]
+        platform, actual_id = playlist_id.split("_", 1)
+        template = PLAYLIST_COVER_TEMPLATES.get(platform)
+        return template.format(actual_id) if template else DEFAULT_COVER_URL
+    
+    # Artist (ar-platform:songId) and album (al-platform:songId) covers use the
+    # song's cover - albumId is the song ID in our implementation
+    song_ref = cover_id[3:] if cover_id.startswith(("ar-", "al-")) else cover_id
+    # Cache is populated by getPlaylist or stream
+    cached_metadata = get_cached(song_metadata_cache, song_ref)
+    if cached_metadata and cached_metadata.get("coverUrl"):
+        return cached_metadata["coverUrl"]
+    platform, sep, song_id = song_ref.partition(":")
+    if not sep:
+        return ""
+    template = SONG_COVER_TEMPLATES.get(platform)
+    return template.format(song_id) if template else DEFAULT_COVER_URL
+
+
+@subsonic_route("getCoverArt")
 @require_auth
 def get_cover_art():
     """Get cover art - proxy image content directly for better iOS compatibility"""
-    import requests as http_requests
-    
     cover_id = request.args.get("id", "")
     
     if not cover_id:
         return Response(status=404)
     
-    cover_url = None
-    
-    # Handle playlist cover (format: pl-platform_id)
-    if cover_id.startswith("pl-"):
-        playlist_id = cover_id[3:]  # Remove "pl-" prefix
-        if "_" in playlist_id:
-            platform, actual_id = playlist_id.split("_", 1)
-            # Check if we have cached playlist data with cover
-            cache_key = f"playlist_detail_{playlist_id}"
-            cached_data = get_cached(playlist_cache, cache_key)
-            if cached_data and cached_data.get("coverUrl"):
-                cover_url = cached_data["coverUrl"]
-            elif platform == "netease":
-                cover_url = f"https://p1.music.126.net/playlist_cover_{actual_id}.jpg"
-            elif platform == "qq":
-                cover_url = "https://y.qq.com/mediastyle/global/img/album_300.png"
-            else:
-                cover_url = "https://y.qq.com/mediastyle/global/img/album_300.png"
-    
-    # Handle artist cover (format: ar-platform:songId) - we use song cover as artist fallback
-    elif cover_id.startswith("ar-"):
-        artist_ref = cover_id[3:]  # Remove "ar-" prefix
-        # artist_ref should be like "platform:songId"
-        cached_metadata = get_cached(song_metadata_cache, artist_ref)
-        if cached_metadata and cached_metadata.get("coverUrl"):
-            cover_url = cached_metadata["coverUrl"]
-        elif ":" in artist_ref:
-            platform, song_id = artist_ref.split(":", 1)
-            if platform == "netease":
-                cover_url = f"https://p1.music.126.net/song_cover_{song_id}.jpg"
-            else:
-                # Use QQ default album image as fallback (more reliable than placeholder)
-                cover_url = "https://y.qq.com/mediastyle/global/img/album_300.png"
-
-    # Handle album cover (format: al-platform:songId) - used by some Subsonic clients
-    # albumId is set to song ID in our implementation
-    elif cover_id.startswith("al-"):
-        album_id = cover_id[3:]  # Remove "al-" prefix
-        # album_id should be same as song ID (e.g., "netease:12345")
-        cached_metadata = get_cached(song_metadata_cache, album_id)
-        if cached_metadata and cached_metadata.get("coverUrl"):
-            cover_url = cached_metadata["coverUrl"]
-        elif ":" in album_id:
-            platform, song_id = album_id.split(":", 1)
-            if platform == "netease":
-                cover_url = f"https://p1.music.126.net/song_cover_{song_id}.jpg"
-            else:
-                cover_url = "https://y.qq.com/mediastyle/global/img/album_300.png"
-    
-    # Handle song cover (format: platform:songId)
-    elif ":" in cover_id:
-        # Check cache first (populated by getPlaylist or stream)
-        cached_metadata = get_cached(song_metadata_cache, cover_id)
-        if cached_metadata and cached_metadata.get("coverUrl"):
-            cover_url = cached_metadata["coverUrl"]
-        else:
-            platform, song_id = cover_id.split(":", 1)
-            if platform == "netease":
-                cover_url = f"https://p1.music.126.net/song_cover_{song_id}.jpg"
-            else:
-                cover_url = "https://y.qq.com/mediastyle/global/img/album_300.png"
+    cover_url = resolve_cover_url(cover_id)
     
     if not cover_url:
         return Response(status=404)
     
+    # Serve from the local cover cache when we've fetched this image before
+    # cleanup_cover_cache may delete it at any moment, so a vanished file just falls through.
+    cover_path = get_cover_cache_path(cover_url)
+    try:
+        return send_file(cover_path, conditional=True, max_age=86400)
+    except FileNotFoundError:
+        pass
+    
     # Proxy the image content directly instead of redirecting
     try:
         logger.info(f"[PROXY] Fetching cover art: {cover_url[:80]}...")
-        resp = http_requests.get(cover_url, timeout=10, headers={
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36",
-            "Referer": "https://music.163.com/"
-        })
+        resp = http_session.get(cover_url, timeout=10, stream=True, headers={"Referer": "https://music.163.com/"})
         if resp.ok:
+            # Stream the image through (and into the cover cache) instead of buffering it
             content_type = resp.headers.get("Content-Type", "image/jpeg")
-            return Response(resp.content, mimetype=content_type)
+            headers = {"Cache-Control": "public, max-age=86400"}
+            if "Content-Length" in resp.headers and "Content-Encoding" not in resp.headers:
+                headers["Content-Length"] = resp.headers["Content-Length"]
+            response = Response(stream_cover_to_cache(resp, cover_path), mimetype=content_type, headers=headers)
+            response.call_on_close(resp.close)
+            return response
         else:
+            resp.close()
             # Fallback to redirect if proxy fails
             logger.warning(f"[PROXY] Failed to fetch cover, status {resp.status_code}, redirecting instead")
             return redirect(cover_url, code=302)
@@ -1773,8 +2419,7 @@ def get_cover_art():
         return redirect(cover_url, code=302)
 
 
-@app.route("/rest/getLyrics", methods=["GET"])
-@app.route("/rest/getLyrics.view", methods=["GET"])
+@subsonic_route("getLyrics")
 @require_auth
 def get_lyrics():
     """Get lyrics by ID or Artist/Title"""
@@ -1785,78 +2430,61 @@ def get_lyrics():
         title = request.args.get("title", "")
         
         lyrics_text = ""
+        free_lookup_failed = False
         
         if song_id:
             # Check cache first
             cached_metadata = get_cached(song_metadata_cache, song_id)
             if cached_metadata and cached_metadata.get("lyrics"):
                 lyrics_text = cached_metadata["lyrics"]
-                logger.info(f"[CACHE HIT] Returning cached lyrics for {song_id}")
+                logger.info("[CACHE HIT] Returning cached lyrics for %s", song_id)
             
-            # If not in cache and looks like netease, try free API
-            elif not lyrics_text and song_id.startswith("netease:"):
-                try:
-                    import requests
-                    actual_id = song_id.split(":")[1]
-                    # Use standard Netease free API
-                    url = f"https://music.163.com/api/song/lyric?id={actual_id}&lv=-1&kv=-1&tv=-1"
-                    headers = {
-                        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36",
-                        "Referer": "https://music.163.com/"
-                    }
-                    resp = requests.get(url, headers=headers, timeout=5)
-                    if resp.ok:
-                        data = resp.json()
-                        lrc = data.get("lrc", {}).get("lyric", "")
-                        tlyric = data.get("tlyric", {}).get("lyric", "") # Translation
-                        
-                        # Combine original and translation
-                        if tlyric:
-                            # Simple concatenation or merging? 
-                            # TuneHub merges them, but here let's just return original for now or simple append
-                            # Actually, apps might handle multiple lines.
-                            # Just return original lrc for now mostly
-                            lyrics_text = lrc
-                        else:
-                            lyrics_text = lrc
-                        
-                        if lyrics_text:
-                            # Cache it
-                            if not cached_metadata:
-                                cached_metadata = {"id": song_id}
-                            cached_metadata["lyrics"] = lyrics_text
-                            set_cached(song_metadata_cache, song_id, cached_metadata)
-                            logger.info(f"[API] Fetched free lyrics for {song_id}")
-                except Exception as e:
-                    logger.warning(f"Failed to fetch free lyrics: {e}")
+            elif lyrics_recently_missed(song_id):
+                logger.info("[CACHE HIT] No lyrics for %s (recent miss)", song_id)
+            
+            # Not cached: try the free platform lyric API first (netease/qq)
+            else:
+                lyrics_text = fetch_free_lyrics(song_id)
+                free_lookup_failed = lyrics_text is None
+                lyrics_text = lyrics_text or ""
+                if lyrics_text:
+                    # Cache it on a copy (see prefetch_lyrics)
+                    cached_metadata = {**(cached_metadata or {"id": song_id}), "lyrics": lyrics_text}
+                    set_cached(song_metadata_cache, song_id, cached_metadata)
+                    logger.info(f"[API] Fetched free lyrics for {song_id}")
             
-            # For QQ/Kuwo, try TuneHub parse API to get lyrics
-            elif not lyrics_text and ":" in song_id:
+            # For QQ/Kuwo, fall back to TuneHub parse API (costs a credit) to get lyrics
+            platform, sep, actual_id = song_id.partition(":")
+            if not lyrics_text and sep and not lyrics_recently_missed(song_id):
                 try:
-                    platform, actual_id = song_id.split(":", 1)
                     if platform in ["qq", "kuwo"]:
                         song_data = tunehub_client.parse_song(platform, actual_id)
                         if song_data.get("lyrics"):
                             lyrics_text = song_data["lyrics"]
                             # Cache the lyrics and other metadata
-                            if not cached_metadata:
-                                cached_metadata = {"id": song_id}
-                            cached_metadata["lyrics"] = lyrics_text
+                            cached_metadata = {**(cached_metadata or {"id": song_id}), "lyrics": lyrics_text}
                             if song_data.get("coverUrl") or song_data.get("cover"):
                                 cached_metadata["coverUrl"] = song_data.get("coverUrl") or song_data.get("cover")
                             set_cached(song_metadata_cache, song_id, cached_metadata)
                             logger.info(f"[TUNEHUB] Fetched lyrics for {song_id}")
                 except Exception as e:
                     logger.warning(f"Failed to fetch TuneHub lyrics: {e}")
-        
-        # Format response
+                else:
+                    # Only a clean empty answer counts as a miss, not an upstream error
+                    if not lyrics_text and not free_lookup_failed:
+                        remember_lyrics_miss(song_id)
+        
+        # Format response - XML is written directly, JSON goes through the element tree
+        # Clients poll this while a song plays, so let them revalidate with If-None-Match
+        if get_response_format() != "json":
+            return make_etag_response(format_lyrics_xml(artist, title, lyrics_text), XML_CONTENT_TYPE)
         root = create_subsonic_response("ok")
         lyrics_elem = SubElement(root, "lyrics")
         if artist: lyrics_elem.set("artist", artist)
         if title: lyrics_elem.set("title", title)
         lyrics_elem.text = lyrics_text
         
-        return make_response_from_element(root)
+        return make_etag_response(*format_response(root, "json"))
     
     except Exception as e:
         logger.error(f"Error getting lyrics: {e}")
@@ -1865,42 +2493,36 @@ def get_lyrics():
 
 # ============ Optional Endpoints (stubs) ============
 
-@app.route("/rest/getAlbumList", methods=["GET"])
-@app.route("/rest/getAlbumList.view", methods=["GET"])
-@app.route("/rest/getAlbumList2", methods=["GET"])
-@app.route("/rest/getAlbumList2.view", methods=["GET"])
+def _empty_list_response(tag: str, **attrs) -> dict:
+    """Prerender an ok response holding one empty list element"""
+    root = create_subsonic_response("ok")
+    elem = SubElement(root, tag)
+    for key, value in attrs.items():
+        elem.set(key, value)
+    return prerender_response(root)
+
+
+ALBUM_LIST_RESPONSE = _empty_list_response("albumList2")
+ARTISTS_RESPONSE = _empty_list_response("artists", ignoredArticles="The El La Los Las Le Les")
+
+@subsonic_route("getAlbumList", "getAlbumList2")
 @require_auth
 def get_album_list():
     """Get album list - returns empty for now"""
-    from xml.etree.ElementTree import Element, SubElement
-    from subsonic_formatter import create_subsonic_response
-    
-    root = create_subsonic_response("ok")
-    SubElement(root, "albumList2")
-    return make_response_from_element(root)
+    return make_prerendered_response(ALBUM_LIST_RESPONSE)
 
 
-@app.route("/rest/getArtists", methods=["GET"])
-@app.route("/rest/getArtists.view", methods=["GET"])
+@subsonic_route("getArtists")
 @require_auth
 def get_artists():
     """Get artists - returns empty for now"""
-    from xml.etree.ElementTree import SubElement
-    from subsonic_formatter import create_subsonic_response
-    
-    root = create_subsonic_response("ok")
-    artists = SubElement(root, "artists")
-    artists.set("ignoredArticles", "The El La Los Las Le Les")
-    return make_response_from_element(root)
+    return make_prerendered_response(ARTISTS_RESPONSE)
 
 
-@app.route("/rest/getArtist", methods=["GET"])
-@app.route("/rest/getArtist.view", methods=["GET"])
+@subsonic_route("getArtist")
 @require_auth
 def get_artist():
     """Get artist details and songs from QQ Music"""
-    from xml.etree.ElementTree import SubElement
-    from subsonic_formatter import create_subsonic_response, _set_song_attributes
     
     try:
         artist_id = request.args.get("id", "")
@@ -1915,11 +2537,9 @@ def get_artist():
             artist_ref = artist_id
         
         # Parse platform and mid
-        if ":" in artist_ref:
-            platform, artist_mid = artist_ref.split(":", 1)
-        else:
-            platform = "qq"
-            artist_mid = artist_ref
+        platform, sep, artist_mid = artist_ref.partition(":")
+        if not sep:
+            platform, artist_mid = "qq", artist_ref
         
         logger.info(f"[ARTIST] Fetching songs for {platform}:{artist_mid}")
         
@@ -1929,10 +2549,7 @@ def get_artist():
         songs = result.get("songs", [])
         
         # Cache song metadata
-        for song in songs:
-            song_id = song.get("id", "")
-            if song_id:
-                set_cached(song_metadata_cache, song_id, song)
+        set_cached_bulk(song_metadata_cache, {song["id"]: song for song in songs if song.get("id")})
         
         # Build response
         root = create_subsonic_response("ok")
@@ -1962,15 +2579,10 @@ def get_artist():
         return make_response_from_element(format_error(0, str(e)))
 
 
-@app.route("/rest/getArtistInfo", methods=["GET"])
-@app.route("/rest/getArtistInfo.view", methods=["GET"])
-@app.route("/rest/getArtistInfo2", methods=["GET"])
-@app.route("/rest/getArtistInfo2.view", methods=["GET"])
+@subsonic_route("getArtistInfo", "getArtistInfo2")
 @require_auth
 def get_artist_info():
     """Get artist info - biography, similar artists, etc."""
-    from xml.etree.ElementTree import SubElement
-    from subsonic_formatter import create_subsonic_response
     
     artist_id = request.args.get("id", "")
     
@@ -1980,11 +2592,9 @@ def get_artist_info():
     else:
         artist_ref = artist_id
     
-    if ":" in artist_ref:
-        platform, artist_mid = artist_ref.split(":", 1)
-    else:
-        platform = "qq"
-        artist_mid = artist_ref
+    platform, sep, artist_mid = artist_ref.partition(":")
+    if not sep:
+        platform, artist_mid = "qq", artist_ref
     
     root = create_subsonic_response("ok")
     info_elem = SubElement(root, "artistInfo2")
@@ -2005,15 +2615,10 @@ def get_artist_info():
     
     return make_response_from_element(root)
 
-@app.route("/rest/getStarred", methods=["GET"])
-@app.route("/rest/getStarred.view", methods=["GET"])
-@app.route("/rest/getStarred2", methods=["GET"])
-@app.route("/rest/getStarred2.view", methods=["GET"])
+@subsonic_route("getStarred", "getStarred2")
 @require_auth
 def get_starred():
     """Get starred songs from user data"""
-    from xml.etree.ElementTree import SubElement
-    from subsonic_formatter import create_subsonic_response, _set_song_attributes
     
     root = create_subsonic_response("ok")
     starred_elem = SubElement(root, "starred2")
@@ -2028,8 +2633,7 @@ def get_starred():
     return make_response_from_element(root)
 
 
-@app.route("/rest/star", methods=["GET", "POST"])
-@app.route("/rest/star.view", methods=["GET", "POST"])
+@subsonic_route("star", methods=["GET", "POST"])
 @require_auth
 def star():
     """Star a song, album, or artist"""
@@ -2041,13 +2645,12 @@ def star():
     if song_id:
         starred_songs.add(song_id)
         logger.info(f"[STAR] Added: {song_id}")
-        save_user_data()
+        save_starred(song_id, True)
     
     return make_response_from_element(create_subsonic_response("ok"))
 
 
-@app.route("/rest/unstar", methods=["GET", "POST"])
-@app.route("/rest/unstar.view", methods=["GET", "POST"])
+@subsonic_route("unstar", methods=["GET", "POST"])
 @require_auth
 def unstar():
     """Unstar a song, album, or artist"""
@@ -2056,13 +2659,12 @@ def unstar():
     if song_id and song_id in starred_songs:
         starred_songs.discard(song_id)
         logger.info(f"[UNSTAR] Removed: {song_id}")
-        save_user_data()
+        save_starred(song_id, False)
     
     return make_response_from_element(create_subsonic_response("ok"))
 
 
-@app.route("/rest/setRating", methods=["GET", "POST"])
-@app.route("/rest/setRating.view", methods=["GET", "POST"])
+@subsonic_route("setRating", methods=["GET", "POST"])
 @require_auth
 def set_rating():
     """Set rating for a song"""
@@ -2078,15 +2680,14 @@ def set_rating():
             else:
                 song_ratings.pop(song_id, None)
                 logger.info(f"[RATING] Removed rating for {song_id}")
-            save_user_data()
+            save_rating(song_id, rating_val)
     except ValueError:
         pass
     
     return make_response_from_element(create_subsonic_response("ok"))
 
 
-@app.route("/rest/scrobble", methods=["GET", "POST"])
-@app.route("/rest/scrobble.view", methods=["GET", "POST"])
+@subsonic_route("scrobble", methods=["GET", "POST"])
 @require_auth
 def scrobble():
     """Record play - just acknowledge, no actual scrobbling"""
@@ -2099,14 +2700,10 @@ def scrobble():
     return make_response_from_element(create_subsonic_response("ok"))
 
 
-@app.route("/rest/getRandomSongs", methods=["GET"])
-@app.route("/rest/getRandomSongs.view", methods=["GET"])
+@subsonic_route("getRandomSongs")
 @require_auth
 def get_random_songs():
     """Get random songs from cached metadata"""
-    import random
-    from xml.etree.ElementTree import SubElement
-    from subsonic_formatter import create_subsonic_response, _set_song_attributes
     
     size = int(request.args.get("size", "50"))
     
@@ -2130,16 +2727,10 @@ def get_random_songs():
     return make_response_from_element(root)
 
 
-@app.route("/rest/getSimilarSongs", methods=["GET"])
-@app.route("/rest/getSimilarSongs.view", methods=["GET"])
-@app.route("/rest/getSimilarSongs2", methods=["GET"])
-@app.route("/rest/getSimilarSongs2.view", methods=["GET"])
+@subsonic_route("getSimilarSongs", "getSimilarSongs2")
 @require_auth
 def get_similar_songs():
     """Get similar songs - returns random songs from same platform"""
-    import random
-    from xml.etree.ElementTree import SubElement
-    from subsonic_formatter import create_subsonic_response, _set_song_attributes
     
     song_id = request.args.get("id", "")
     count = int(request.args.get("count", "20"))
@@ -2148,9 +2739,9 @@ def get_similar_songs():
     similar_elem = SubElement(root, "similarSongs2")
     
     # Determine platform from song ID
-    platform = ""
-    if ":" in song_id:
-        platform = song_id.split(":")[0]
+    platform, sep, _ = song_id.partition(":")
+    if not sep:
+        platform = ""
     
     # Get songs from same platform
     same_platform_songs = []
@@ -2171,14 +2762,10 @@ def get_similar_songs():
     return make_response_from_element(root)
 
 
-@app.route("/rest/createPlaylist", methods=["GET", "POST"])
-@app.route("/rest/createPlaylist.view", methods=["GET", "POST"])
+@subsonic_route("createPlaylist", methods=["GET", "POST"])
 @require_auth
 def create_playlist():
     """Create a new playlist or add songs to existing"""
-    import uuid
-    from xml.etree.ElementTree import SubElement
-    from subsonic_formatter import create_subsonic_response
     
     playlist_id = request.args.get("playlistId", "")
     name = request.args.get("name", "")
@@ -2199,7 +2786,8 @@ def create_playlist():
         playlist_id = new_id
         logger.info(f"[PLAYLIST] Created new playlist: {name} ({new_id})")
     
-    save_user_data()
+    if playlist_id in user_playlists:
+        save_playlist(playlist_id)
     
     # Return playlist info
     root = create_subsonic_response("ok")
@@ -2212,8 +2800,7 @@ def create_playlist():
     return make_response_from_element(root)
 
 
-@app.route("/rest/updatePlaylist", methods=["GET", "POST"])
-@app.route("/rest/updatePlaylist.view", methods=["GET", "POST"])
+@subsonic_route("updatePlaylist", methods=["GET", "POST"])
 @require_auth
 def update_playlist():
     """Update playlist (rename, add/remove songs)"""
@@ -2237,14 +2824,13 @@ def update_playlist():
                 if 0 <= idx < len(user_playlists[playlist_id]["songs"]):
                     user_playlists[playlist_id]["songs"].pop(idx)
         
-        save_user_data()
+        save_playlist(playlist_id)
         logger.info(f"[PLAYLIST] Updated: {playlist_id}")
     
     return make_response_from_element(create_subsonic_response("ok"))
 
 
-@app.route("/rest/deletePlaylist", methods=["GET", "POST"])
-@app.route("/rest/deletePlaylist.view", methods=["GET", "POST"])
+@subsonic_route("deletePlaylist", methods=["GET", "POST"])
 @require_auth
 def delete_playlist():
     """Delete a playlist"""
@@ -2252,22 +2838,18 @@ def delete_playlist():
     
     if playlist_id and playlist_id in user_playlists:
         del user_playlists[playlist_id]
-        save_user_data()
+        delete_saved_playlist(playlist_id)
         logger.info(f"[PLAYLIST] Deleted: {playlist_id}")
     
     return make_response_from_element(create_subsonic_response("ok"))
 
 
 
-@app.route("/rest/getInternetRadioStations", methods=["GET"])
-@app.route("/rest/getInternetRadioStations.view", methods=["GET"])
+@subsonic_route("getInternetRadioStations")
 @require_auth
 def get_internet_radio_stations():
     """Get internet radio stations - mapped from TuneHub toplists"""
     try:
-        from xml.etree.ElementTree import SubElement
-        from subsonic_formatter import create_subsonic_response
-        
         platform = request.args.get("platform", DEFAULT_PLATFORM)
         toplists = tunehub_client.get_toplists(platform)
         
@@ -2280,10 +2862,10 @@ def get_internet_radio_stations():
             station.set("id", station_id)
             station.set("name", toplist.get("name", "Unknown"))
             # Stream URL points to our M3U endpoint
-            station.set("streamUrl", f"http://{request.host}/m3u/{station_id}.m3u")
+            station.set("streamUrl", f"http://{request.host}/m3u/{station_id}.m3u?{M3U_AUTH_QUERY}")
             station.set("homePageUrl", f"https://tunehub.sayqz.com")
         
-        return make_response_from_element(root)
+        return make_etag_response(*format_response(root, get_response_format()))
     
     except Exception as e:
         logger.error(f"Error getting radio stations: {e}")
@@ -2293,58 +2875,107 @@ def get_internet_radio_stations():
 # ============ M3U Playlist Endpoints ============
 
 # Cache for M3U playlists (updated every 6 hours)
-import time
-m3u_cache = {}
+# playlist_id -> (content, monotonic timestamp, host), oldest first; bounded so unknown ids can't
+# grow it forever. Monotonic so wall-clock adjustments (NTP) can't expire or extend entries.
+m3u_cache = OrderedDict()
 M3U_CACHE_DURATION = 6 * 60 * 60  # 6 hours in seconds
+M3U_CACHE_SIZE = 256
+m3u_cache_lock = threading.Lock()  # OrderedDict reordering/trimming is multi-step
+
+# Auth query for M3U links. The M3U routes require auth like /rest, so only authenticated callers
+# see it; it carries a Subsonic token (md5(password + salt)) with a per-process salt, never the password
+_M3U_SALT = secrets.token_hex(8)
+M3U_AUTH_QUERY = f"u={quote(SUBSONIC_USER)}&t={_token_for_salt(_M3U_SALT).decode()}&s={_M3U_SALT}&v=1.16.0&c=m3u"
+
+def iter_m3u_lines(playlist_name: str, songs: list, host: str):
+    """Yield the M3U header, then an EXTINF + stream URL pair per song"""
+    yield f"#EXTM3U\n#PLAYLIST:{playlist_name}\n"
+    # Stream URL (requires auth, so use direct format) - everything but the id is fixed
+    url_prefix = f"http://{host}/rest/stream.view?{M3U_AUTH_QUERY}&id="
+    for song in songs:
+        duration = song.get("duration", 0)
+        title = song.get("title", "Unknown")
+        artist = song.get("artist", "Unknown")
+        song_id = song.get("id", "")
+        
+        # EXTINF line: duration, artist - title
+        yield f"#EXTINF:{duration},{artist} - {title}\n" + url_prefix + song_id + "\n"
+
+def store_m3u(cache_key: str, content: str, timestamp: float, host: str):
+    """Cache generated M3U text, dropping the oldest playlists beyond M3U_CACHE_SIZE"""
+    with m3u_cache_lock:
+        m3u_cache.pop(cache_key, None)
+        m3u_cache[cache_key] = (content, timestamp, host)
+        while len(m3u_cache) > M3U_CACHE_SIZE:
+            m3u_cache.popitem(last=False)
+
+def split_m3u_playlist_id(playlist_id: str) -> tuple:
+    """Split an M3U playlist id (platform_id) into (platform, actual_id)"""
+    platform, sep, actual_id = playlist_id.partition("_")
+    if not sep:
+        return DEFAULT_PLATFORM, playlist_id
+    return platform, actual_id
+
+def refresh_m3u_cache():
+    """Regenerate every cached M3U playlist ahead of expiry (run by the playlist refresher)"""
+    refreshed = 0
+    for cache_key, (_, _, host) in list(m3u_cache.items()):
+        try:
+            platform, actual_id = split_m3u_playlist_id(cache_key)
+            result = tunehub_client.get_toplist_detail(platform, actual_id)
+            content = "".join(iter_m3u_lines(result.get("name", "TuneHub Playlist"), result.get("songs", []), host))
+            store_m3u(cache_key, content, time.monotonic(), host)
+            refreshed += 1
+        except Exception as e:
+            logger.error(f"[SCHEDULED REFRESH] Failed to refresh M3U {cache_key}: {e}")
+    if refreshed:
+        logger.info(f"[SCHEDULED REFRESH] Regenerated {refreshed} M3U playlists")
 
 
 @app.route("/m3u/<playlist_id>.m3u", methods=["GET"])
+@require_auth
 def get_m3u_playlist(playlist_id):
     """Generate M3U playlist for a toplist"""
     try:
         # Check cache
         cache_key = playlist_id
-        current_time = time.time()
+        current_time = time.monotonic()
         
-        if cache_key in m3u_cache:
-            cached_data, cached_time = m3u_cache[cache_key]
-            if current_time - cached_time < M3U_CACHE_DURATION:
-                return Response(cached_data, content_type="audio/x-mpegurl")
+        cached = m3u_cache.get(cache_key)
+        if cached is not None and current_time - cached[1] < M3U_CACHE_DURATION:
+            return Response(cached[0], content_type="audio/x-mpegurl")
         
         # Parse platform and actual ID
-        if "_" in playlist_id:
-            platform, actual_id = playlist_id.split("_", 1)
-        else:
-            platform = DEFAULT_PLATFORM
-            actual_id = playlist_id
+        platform, actual_id = split_m3u_playlist_id(playlist_id)
         
         # Get playlist detail
         result = tunehub_client.get_toplist_detail(platform, actual_id)
         songs = result.get("songs", [])
         playlist_name = result.get("name", "TuneHub Playlist")
         
-        # Generate M3U content
-        m3u_lines = ["#EXTM3U", f"#PLAYLIST:{playlist_name}"]
-        
+        # Prime the metadata cache (free) so the player's follow-up getSong/cover/lyrics
+        # calls for these tracks are served locally; keep entries that already have lyrics
+        updates = {}
         for song in songs:
-            duration = song.get("duration", 0)
-            title = song.get("title", "Unknown")
-            artist = song.get("artist", "Unknown")
-            song_id = song.get("id", "")
-            
-            # EXTINF line: duration, artist - title
-            m3u_lines.append(f"#EXTINF:{duration},{artist} - {title}")
-            # Stream URL (requires auth, so use direct format)
-            m3u_lines.append(f"http://{request.host}/rest/stream.view?id={song_id}&u=admin&p=admin&v=1.16.0&c=m3u")
-        
-        m3u_content = "\n".join(m3u_lines)
+            song_id = song.get("id")
+            if song_id:
+                existing = get_cached(song_metadata_cache, song_id)
+                if not existing or not existing.get("lyrics"):
+                    updates[song_id] = song
+        set_cached_bulk(song_metadata_cache, updates)
         
-        # Cache the result
-        m3u_cache[cache_key] = (m3u_content, current_time)
+        # Stream the M3U line by line; the joined text is cached once fully sent
+        host = request.host  # Request context is gone once the generator runs
         
-        logger.info(f"Generated M3U playlist: {playlist_name} with {len(songs)} songs")
+        def generate():
+            parts = []
+            for part in iter_m3u_lines(playlist_name, songs, host):
+                parts.append(part)
+                yield part
+            store_m3u(cache_key, "".join(parts), current_time, host)
+            logger.info(f"Generated M3U playlist: {playlist_name} with {len(songs)} songs")
         
-        return Response(m3u_content, content_type="audio/x-mpegurl",
+        return Response(generate(), content_type="audio/x-mpegurl",
                        headers={"Content-Disposition": f"inline; filename={playlist_id}.m3u"})
     
     except Exception as e:
@@ -2352,27 +2983,40 @@ def get_m3u_playlist(playlist_id):
         return Response(f"# Error: {e}", status=500, content_type="text/plain")
 
 
+# platform -> (rendered HTML, monotonic timestamp), only for known platforms
+m3u_list_cache = {}
+
 @app.route("/m3u/list", methods=["GET"])
+@require_auth
 def list_m3u_playlists():
     """List all available M3U playlists"""
     try:
         platform = request.args.get("platform", DEFAULT_PLATFORM)
-        toplists = tunehub_client.get_toplists(platform)
         
-        html = "<html><head><title>TuneHub M3U Playlists</title></head><body>"
-        html += "<h1>🎵 TuneHub M3U Playlists</h1>"
-        html += f"<p>Platform: {platform}</p>"
-        html += "<ul>"
+        cached = m3u_list_cache.get(platform)
+        if cached is not None and time.monotonic() - cached[1] < M3U_CACHE_DURATION:
+            return Response(cached[0], content_type="text/html")
+        
+        toplists = tunehub_client.get_toplists(platform)
         
+        parts = [
+            "<html><head><title>TuneHub M3U Playlists</title></head><body>",
+            "<h1>🎵 TuneHub M3U Playlists</h1>",
+            f"<p>Platform: {html_escape(platform)}</p>",
+            "<ul>",
+        ]
         for toplist in toplists:
-            playlist_id = f"{toplist.get('platform', 'netease')}_{toplist.get('id', '')}"
-            name = toplist.get("name", "Unknown")
+            playlist_id = quote(f"{toplist.get('platform', 'netease')}_{toplist.get('id', '')}")
+            name = html_escape(toplist.get("name", "Unknown"))
             count = toplist.get("trackCount", 0)
-            html += f'<li><a href="/m3u/{playlist_id}.m3u">{name}</a> ({count} songs)</li>'
+            parts.append(f'<li><a href="/m3u/{playlist_id}.m3u?{M3U_AUTH_QUERY}">{name}</a> ({count} songs)</li>')
+        parts.append("</ul>")
+        parts.append("<p><em>Playlists are cached for 6 hours.</em></p>")
+        parts.append("</body></html>")
+        html = "".join(parts)
         
-        html += "</ul>"
-        html += "<p><em>Playlists are cached for 6 hours.</em></p>"
-        html += "</body></html>"
+        if platform in PLATFORMS:
+            m3u_list_cache[platform] = (html, time.monotonic())
         
         return Response(html, content_type="text/html")
     
@@ -2421,4 +3065,6 @@ if __name__ == "__main__":
     # Start background playlist refresh scheduler
     start_playlist_refresh_scheduler()
     
-    app.run(host=SERVER_HOST, port=SERVER_PORT, debug=False)
+    # Thread per request, so a slow upstream call never blocks other clients.
+    # Stay single-process: caches, user data and the credits log live in this process's memory.
+    app.run(host=SERVER_HOST, port=SERVER_PORT, debug=False, threaded=True)
@@ -1,23 +1,47 @@
 # Subsonic Response Formatter
 # Converts TuneHub data to Subsonic XML/JSON format
 
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterator, List, Optional, Union
 from xml.etree.ElementTree import Element, SubElement, tostring
-import json
+from xml.sax.saxutils import escape
+import orjson
 
-from config import SUBSONIC_VERSION, SUBSONIC_SERVER_NAME
+from config import SUBSONIC_VERSION, SUBSONIC_SERVER_NAME, DEFAULT_QUALITY
+
+
+# (bitRate, suffix, contentType) advertised for songs, resolved once from DEFAULT_QUALITY
+_QUALITY_ATTRIBUTES = {
+    "flac": ("1411", "flac", "audio/flac"),  # CD quality
+    "flac24bit": ("2304", "flac", "audio/flac"),  # 24-bit/96kHz
+    "320k": ("320", "mp3", "audio/mpeg"),
+    "128k": ("128", "mp3", "audio/mpeg"),
+}[DEFAULT_QUALITY]
+
+
+# Attributes of every subsonic-response root, in output order (status is filled in per call)
+_RESPONSE_ATTRIBUTES = {
+    "xmlns": "http://subsonic.org/restapi",
+    "status": "ok",
+    "version": SUBSONIC_VERSION,
+    "type": SUBSONIC_SERVER_NAME,
+    "serverVersion": "1.0.0",
+    # OpenSubsonic support - required for Amperfy to detect lyrics feature
+    "openSubsonic": "true",
+}
+
+
+# Platform name mapping for search display (artist/album name prefixes)
+PLATFORM_DISPLAY_NAMES = {
+    "netease": "网易云",
+    "qq": "QQ",
+    "kuwo": "酷我",
+}
 
 
 def create_subsonic_response(status: str = "ok") -> Element:
     """Create base subsonic-response element"""
-    root = Element("subsonic-response")
-    root.set("xmlns", "http://subsonic.org/restapi")
+    root = Element("subsonic-response", _RESPONSE_ATTRIBUTES)  # Element copies the dict
     root.set("status", status)
-    root.set("version", SUBSONIC_VERSION)
-    root.set("type", SUBSONIC_SERVER_NAME)
-    root.set("serverVersion", "1.0.0")
-    # OpenSubsonic support - required for Amperfy to detect lyrics feature
-    root.set("openSubsonic", "true")
     return root
 
 
@@ -129,29 +153,16 @@ def format_search_result(songs: List[Dict[str, Any]], query: str = "") -> Elemen
     root = create_subsonic_response("ok")
     search_result = SubElement(root, "searchResult2")
     
-    # Platform name mapping for search display
-    platform_names = {
-        "netease": "网易云",
-        "qq": "QQ",
-        "kuwo": "酷我"
-    }
-    
     for song in songs:
         song_elem = SubElement(search_result, "song")
+        _set_song_attributes(song_elem, song)
         
         # Extract platform from song ID (e.g., "qq:001QOh2S0pH6Ji" -> "qq")
-        song_id = song.get("id", "")
-        platform = ""
-        if ":" in song_id:
-            platform = song_id.split(":")[0]
+        platform, sep, _ = song.get("id", "").partition(":")
         
-        # Create a copy of song with platform prefix in artist name (not title)
-        display_song = song.copy()
-        original_artist = song.get("artist", "Unknown")
-        if platform and platform in platform_names:
-            display_song["artist"] = f"{platform_names[platform]} - {original_artist}"
-        
-        _set_song_attributes(song_elem, display_song)
+        # Platform prefix in artist name (not title); set() keeps the attribute's position
+        if sep and platform in PLATFORM_DISPLAY_NAMES:
+            song_elem.set("artist", f"{PLATFORM_DISPLAY_NAMES[platform]} - {song.get('artist', 'Unknown')}")
     
     return root
 
@@ -167,56 +178,42 @@ def format_song(song: Dict[str, Any]) -> Element:
 def _set_song_attributes(elem: Element, song: Dict[str, Any]) -> None:
     """Set common song attributes on an element"""
     song_id = song.get("id", "")
-    elem.set("id", song_id)
-    elem.set("parent", "1")
-    elem.set("title", song.get("title", "Unknown"))
-    elem.set("album", song.get("album", "") or song.get("title", "Unknown"))
     # Strip platform prefix from artist name (e.g., "qq:周杰伦" -> "周杰伦")
     artist = song.get("artist", "Unknown")
-    if ":" in artist and artist.split(":")[0].lower() in ("netease", "qq", "kuwo"):
-        artist = artist.split(":", 1)[1]
-    elem.set("artist", artist)
-    elem.set("isDir", "false")
-    elem.set("duration", str(song.get("duration", 0)))
-    elem.set("track", "1")
-    elem.set("year", "2024")
-    elem.set("genre", "Pop")
+    prefix, sep, name = artist.partition(":")
+    if sep and prefix.lower() in ("netease", "qq", "kuwo"):
+        artist = name
     
     # Set bitRate and suffix based on configured quality
-    from config import DEFAULT_QUALITY
-    if DEFAULT_QUALITY == "flac":
-        elem.set("bitRate", "1411")  # CD quality
-        elem.set("suffix", "flac")
-        elem.set("contentType", "audio/flac")
-    elif DEFAULT_QUALITY == "flac24bit":
-        elem.set("bitRate", "2304")  # 24-bit/96kHz
-        elem.set("suffix", "flac")
-        elem.set("contentType", "audio/flac")
-    elif DEFAULT_QUALITY == "320k":
-        elem.set("bitRate", "320")
-        elem.set("suffix", "mp3")
-        elem.set("contentType", "audio/mpeg")
-    else:  # 128k
-        elem.set("bitRate", "128")
-        elem.set("suffix", "mp3")
-        elem.set("contentType", "audio/mpeg")
-    
-    elem.set("size", "10000000")  # Approximate file size
-    elem.set("isVideo", "false")
-    elem.set("type", "music")
-    
-    # CRITICAL for Amperfy: Set artistId (using song_id as synthetic artist ID)
-    elem.set("artistId", f"ar-{song_id}")
-    
-    # Set albumId for clients that use it for cover art
-    # Use song ID as album ID since we treat each song as its own "album"
-    elem.set("albumId", song_id)
+    bit_rate, suffix, content_type = _QUALITY_ATTRIBUTES
     
-    # Always set coverArt (Amperfy needs this)
-    elem.set("coverArt", song_id)
-    
-    elem.set("path", f"music/{song_id}.flac")
-    elem.set("created", "2024-01-01T00:00:00")
+    # One dict update instead of ~20 set() calls - this runs for every song in every list
+    elem.attrib.update({
+        "id": song_id,
+        "parent": "1",
+        "title": song.get("title", "Unknown"),
+        "album": song.get("album", "") or song.get("title", "Unknown"),
+        "artist": artist,
+        "isDir": "false",
+        "duration": str(song.get("duration", 0)),
+        "track": "1",
+        "year": "2024",
+        "genre": "Pop",
+        "bitRate": bit_rate,
+        "suffix": suffix,
+        "contentType": content_type,
+        "size": "10000000",  # Approximate file size
+        "isVideo": "false",
+        "type": "music",
+        # CRITICAL for Amperfy: Set artistId (using song_id as synthetic artist ID)
+        "artistId": f"ar-{song_id}",
+        # Use song ID as album ID since we treat each song as its own "album"
+        "albumId": song_id,
+        # Always set coverArt (Amperfy needs this)
+        "coverArt": song_id,
+        "path": f"music/{song_id}.flac",
+        "created": "2024-01-01T00:00:00",
+    })
 
 
 def format_music_folders() -> Element:
@@ -241,9 +238,63 @@ def format_indexes() -> Element:
     return root
 
 
-def xml_to_string(element: Element) -> str:
-    """Convert Element to XML string with declaration"""
-    return '<?xml version="1.0" encoding="UTF-8"?>\n' + tostring(element, encoding="unicode")
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+XML_CONTENT_TYPE = "text/xml; charset=utf-8"
+_XML_DECLARATION_BYTES = XML_DECLARATION.encode("utf-8")
+
+
+def xml_to_bytes(element: Element) -> bytes:
+    """Serialize Element straight to UTF-8 bytes with our declaration (no str round trip)"""
+    return _XML_DECLARATION_BYTES + tostring(element, encoding="utf-8", xml_declaration=False,
+                                             short_empty_elements=True)
+
+
+# ============ Direct XML (small hot responses, no ElementTree) ============
+
+# Same escaping ElementTree applies to attribute values
+_ATTR_ENTITIES = {'"': "&quot;", "\r": "&#13;", "\n": "&#10;", "\t": "&#09;"}
+
+
+def _xml_attr(value: str) -> str:
+    """Escape a string for use inside a double-quoted XML attribute"""
+    return escape(value, _ATTR_ENTITIES)
+
+
+# Opening tag of an ok response, derived from create_subsonic_response so they can't drift
+_OK_RESPONSE_OPEN = "<subsonic-response" + "".join(
+    f' {key}="{_xml_attr(value)}"' for key, value in create_subsonic_response("ok").attrib.items()
+) + ">"
+
+
+def format_lyrics_xml(artist: str, title: str, lyrics_text: str) -> str:
+    """Serialize a getLyrics response directly, byte-identical to the ElementTree output"""
+    attrs = ""
+    if artist:
+        attrs += f' artist="{_xml_attr(artist)}"'
+    if title:
+        attrs += f' title="{_xml_attr(title)}"'
+    lyrics = f"<lyrics{attrs}>{escape(lyrics_text)}</lyrics>" if lyrics_text else f"<lyrics{attrs} />"
+    return f"{XML_DECLARATION}{_OK_RESPONSE_OPEN}{lyrics}</subsonic-response>"
+
+
+def iter_structured_lyrics_xml(display_artist: str, title: str, synced: bool, lines: list) -> Iterator[str]:
+    """Serialize a getLyricsBySongId response in chunks, byte-identical to the ElementTree output
+    
+    lines holds (start ms, text) tuples when synced, plain strings otherwise.
+    """
+    yield f"{XML_DECLARATION}{_OK_RESPONSE_OPEN}"
+    if not lines:
+        yield "<lyricsList /></subsonic-response>"
+        return
+    yield (f'<lyricsList><structuredLyrics displayArtist="{_xml_attr(display_artist)}" '
+           f'displayTitle="{_xml_attr(title)}" lang="zh" synced="{"true" if synced else "false"}" offset="0">')
+    # A hundred lines per chunk keeps socket writes few without holding the whole document
+    for i in range(0, len(lines), 100):
+        if synced:
+            yield "".join(f'<line start="{start}">{escape(text)}</line>' for start, text in lines[i:i + 100])
+        else:
+            yield "".join(f"<line>{escape(text)}</line>" for text in lines[i:i + 100])
+    yield "</structuredLyrics></lyricsList></subsonic-response>"
 
 
 def xml_to_json(element: Element) -> Dict[str, Any]:
@@ -289,9 +340,9 @@ def xml_to_json(element: Element) -> Dict[str, Any]:
     return {"subsonic-response": element_to_dict(element)}
 
 
-def format_response(element: Element, response_format: str = "xml") -> tuple[str, str]:
+def format_response(element: Element, response_format: str = "xml") -> tuple[Union[str, bytes], str]:
     """Format response as XML or JSON, return (content, content_type)"""
     if response_format.lower() == "json":
-        return json.dumps(xml_to_json(element), ensure_ascii=False), "application/json"
+        return orjson.dumps(xml_to_json(element)), "application/json"
     else:
-        return xml_to_string(element), "text/xml; charset=utf-8"
+        return xml_to_bytes(element), XML_CONTENT_TYPE
@@ -0,0 +1,43 @@
+# Freeze a .env file into env_generated.py
+#
+# config.py imports env_generated.py when it exists instead of parsing .env
+# with python-dotenv on every start. Re-run this script after editing .env.
+#
+# Usage: python tools/freeze_env.py [path/to/.env]
+
+import os
+import sys
+
+from dotenv import dotenv_values
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTPUT_FILE = os.path.join(ROOT_DIR, "env_generated.py")
+
+
+def freeze_env(env_path: str) -> int:
+    """Write the key/value pairs of env_path to env_generated.py, return the count"""
+    values = {k: v for k, v in dotenv_values(env_path).items() if v is not None}
+    
+    lines = [
+        "# Generated by tools/freeze_env.py - do not edit, do not commit",
+        f"# Source: {os.path.abspath(env_path)}",
+        "",
+        "ENV = {",
+    ]
+    for key, value in values.items():
+        lines.append(f"    {key!r}: {value!r},")
+    lines.append("}")
+    
+    temp_file = OUTPUT_FILE + ".tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(temp_file, OUTPUT_FILE)
+    return len(values)
+
+
+if __name__ == "__main__":
+    env_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT_DIR, ".env")
+    if not os.path.exists(env_path):
+        sys.exit(f"No such file: {env_path}")
+    count = freeze_env(env_path)
+    print(f"Wrote {count} variables to {OUTPUT_FILE}")
@@ -1,9 +1,27 @@
 # TuneHub API Client
 
+import threading
+import time
 import requests
-from typing import Optional, Dict, Any, List
+from requests.adapters import HTTPAdapter
+from typing import Optional, Dict, Any, Callable, List
+import orjson
 from config import TUNEHUB_API_KEY, TUNEHUB_BASE_URL, DEFAULT_PLATFORM, DEFAULT_QUALITY
 
+# TTLs for the in-process response cache (seconds). The server's scheduled playlist
+# refresh calls invalidate_toplists() first, so it always sees new data.
+METHOD_CONFIG_TTL = 60 * 60
+TOPLIST_TTL = 60 * 60
+
+
+def _json(response: requests.Response) -> Any:
+    """Decode a JSON response body with orjson"""
+    try:
+        return orjson.loads(response.content)
+    except orjson.JSONDecodeError:
+        # e.g. a non-UTF-8 body - let requests detect the encoding
+        return response.json()
+
 
 class TuneHubClient:
     """Client for interacting with TuneHub V3 API"""
@@ -15,13 +33,61 @@ class TuneHubClient:
             "X-API-Key": self.api_key,
             "Content-Type": "application/json",
         }
+        # One keep-alive session for TuneHub and the platform APIs it points at.
+        # Pool sized for the server's request threads plus concurrent search/toplist fan-out.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Read-only responses: key -> (value, monotonic expires_at)
+        self._response_cache: Dict[Any, tuple] = {}
+        self._response_cache_lock = threading.Lock()
+        # key -> Lock held by the thread currently loading it (single-flight on misses)
+        self._loading: Dict[Any, threading.Lock] = {}
+
+    def _cached(self, key: Any, ttl: int, loader: Callable[[], Any]) -> Any:
+        """Return a cached value for key, calling loader() on a miss or after ttl seconds
+        
+        Concurrent misses for the same key wait for a single loader() call.
+        """
+        entry = self._response_cache.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        with self._response_cache_lock:
+            load_lock = self._loading.setdefault(key, threading.Lock())
+        with load_lock:
+            # Another thread may have loaded it while we waited
+            entry = self._response_cache.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+            try:
+                value = loader()
+                with self._response_cache_lock:
+                    self._response_cache[key] = (value, time.monotonic() + ttl)
+            finally:
+                # Drop the lock so keys taken from request URLs can't pile up
+                with self._response_cache_lock:
+                    if self._loading.get(key) is load_lock:
+                        del self._loading[key]
+        return value
+
+    def invalidate_toplists(self) -> None:
+        """Drop cached toplists and toplist details so the next call hits upstream"""
+        with self._response_cache_lock:
+            for key in [k for k in self._response_cache if k[0] in ("toplists", "toplist")]:
+                del self._response_cache[key]
 
     def _get_method_config(self, platform: str, function: str) -> Dict[str, Any]:
-        """Get method configuration from TuneHub (free, no credits consumed)"""
+        """Get method configuration from TuneHub (free, no credits consumed; cached)"""
+        return self._cached(("method", platform, function), METHOD_CONFIG_TTL,
+                            lambda: self._fetch_method_config(platform, function))
+
+    def _fetch_method_config(self, platform: str, function: str) -> Dict[str, Any]:
+        """Fetch method configuration from TuneHub"""
         url = f"{self.base_url}/v1/methods/{platform}/{function}"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, headers=self.headers, timeout=10)
         response.raise_for_status()
-        data = response.json()
+        data = _json(response)
         if data.get("code") != 0:
             raise Exception(f"TuneHub API error: {data.get('message', 'Unknown error')}")
         return data.get("data", {})
@@ -92,19 +158,23 @@ class TuneHubClient:
         headers = config.get("headers", {})
         
         if method == "GET":
-            response = requests.get(url, params=params, headers=headers, timeout=10)
+            response = self.session.get(url, params=params, headers=headers, timeout=10)
         else:
             # Deep copy and replace templates in body
             body = copy.deepcopy(config.get("body", {}))
             body = replace_template(body, variables)
-            response = requests.post(url, params=params, json=body, headers=headers, timeout=10)
+            response = self.session.post(url, params=params, json=body, headers=headers, timeout=10)
 
         response.raise_for_status()
-        return response.json()
+        return _json(response)
 
     def get_toplists(self, platform: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Get list of top charts/playlists for a platform"""
+        """Get list of top charts/playlists for a platform (cached for TOPLIST_TTL)"""
         platform = platform or DEFAULT_PLATFORM
+        return self._cached(("toplists", platform), TOPLIST_TTL, lambda: self._fetch_toplists(platform))
+
+    def _fetch_toplists(self, platform: str) -> List[Dict[str, Any]]:
+        """Fetch toplists for a platform from upstream"""
         config = self._get_method_config(platform, "toplists")
         result = self._execute_method(config)
         
@@ -112,7 +182,12 @@ class TuneHubClient:
         return self._parse_toplists_result(platform, result)
 
     def get_toplist_detail(self, platform: str, toplist_id: str) -> Dict[str, Any]:
-        """Get songs from a specific toplist"""
+        """Get songs from a specific toplist (cached for TOPLIST_TTL)"""
+        return self._cached(("toplist", platform, toplist_id), TOPLIST_TTL,
+                            lambda: self._fetch_toplist_detail(platform, toplist_id))
+
+    def _fetch_toplist_detail(self, platform: str, toplist_id: str) -> Dict[str, Any]:
+        """Fetch songs from a specific toplist from upstream"""
         config = self._get_method_config(platform, "toplist")
         result = self._execute_method(config, {"id": toplist_id})
         
@@ -139,9 +214,9 @@ class TuneHubClient:
                 }
             }
             headers = {"Content-Type": "application/json", "Referer": "https://y.qq.com/"}
-            response = requests.post(url, json=body, headers=headers, timeout=10)
+            response = self.session.post(url, json=body, headers=headers, timeout=10)
             response.raise_for_status()
-            result = response.json()
+            result = _json(response)
         else:
             # Use TuneHub method config for other platforms
             config = self._get_method_config(platform, "search")
@@ -181,11 +256,11 @@ class TuneHubClient:
                 "Referer": "https://music.163.com/"
             }
             
-            resp = requests.get(url, headers=headers, timeout=5)
+            resp = self.session.get(url, headers=headers, timeout=5)
             if not resp.ok:
                 return songs
             
-            data = resp.json()
+            data = _json(resp)
             detail_songs = data.get("songs", [])
             
             # Build ID -> picUrl map
@@ -222,9 +297,9 @@ class TuneHubClient:
         
         try:
             # Increased timeout to 30s for slow API responses
-            response = requests.post(url, json=payload, headers=self.headers, timeout=30)
+            response = self.session.post(url, json=payload, headers=self.headers, timeout=30)
             response.raise_for_status()
-            data = response.json()
+            data = _json(response)
         except requests.exceptions.Timeout:
             raise Exception(f"TuneHub API timeout after 30s for {platform}:{song_id}")
         except requests.exceptions.RequestException as e:
@@ -468,9 +543,9 @@ class TuneHubClient:
                 }
             }
             headers = {"Content-Type": "application/json", "Referer": "https://y.qq.com/"}
-            response = requests.post(url, json=body, headers=headers, timeout=10)
+            response = self.session.post(url, json=body, headers=headers, timeout=10)
             response.raise_for_status()
-            result = response.json()
+            result = _json(response)
             
             # Parse artist results
             artists = []
@@ -519,9 +594,9 @@ class TuneHubClient:
                 }
             }
             headers = {"Content-Type": "application/json", "Referer": "https://y.qq.com/"}
-            response = requests.post(url, json=body, headers=headers, timeout=10)
+            response = self.session.post(url, json=body, headers=headers, timeout=10)
             response.raise_for_status()
-            result = response.json()
+            result = _json(response)
             
             # Parse album results
             albums = []
@@ -576,9 +651,9 @@ class TuneHubClient:
                 }
             }
             headers = {"Content-Type": "application/json", "Referer": "https://y.qq.com/"}
-            response = requests.post(url, json=body, headers=headers, timeout=10)
+            response = self.session.post(url, json=body, headers=headers, timeout=10)
             response.raise_for_status()
-            result = response.json()
+            result = _json(response)
             
             try:
                 data = result.get("req_1", {}).get("data", {})
@@ -613,9 +688,9 @@ class TuneHubClient:
             # Use the fcg album info API which returns song list
             url = f"https://i.y.qq.com/v8/fcg-bin/fcg_v8_album_info_cp.fcg?albummid={album_mid}&format=json"
             headers = {"Referer": "https://y.qq.com/"}
-            response = requests.get(url, headers=headers, timeout=10)
+            response = self.session.get(url, headers=headers, timeout=10)
             response.raise_for_status()
-            result = response.json()
+            result = _json(response)
             
             try:
                 data = result.get("data", {})